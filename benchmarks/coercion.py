@@ -0,0 +1,73 @@
+"""Compares the per-cell and vectorised type coercion of exported results.
+
+Usage: python -m benchmarks.coercion [--rows 50000]
+"""
+
+import argparse
+import random
+import timeit
+
+import pandas as pd
+
+from exporters import coercion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("-n", "--number", type=int, default=3)
+    args = parser.parse_args()
+
+    df = _make_results(args.rows)
+    for name, coerce in [("per-cell", _coerce_per_cell), ("vectorised", _coerce)]:
+        seconds = timeit.timeit(lambda c=coerce: c(df.copy()), number=args.number)
+        print(f"{name:12} {seconds / args.number * 1000:10.1f}ms")
+
+
+def _make_results(rows: int) -> pd.DataFrame:
+    random.seed(0)
+    results = []
+    for i in range(rows):
+        finished = random.random() > 0.02
+        seconds = random.randint(1800, 6 * 3600)
+        results.append(
+            {
+                "Pos": str(i + 1) if finished else "DNF",
+                "CatPos": str(random.randint(1, 500)),
+                "Name": f"Runner {i}",
+                "StartTime": "2024-03-02 06:00:00",
+                "Time": (
+                    f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+                    if finished
+                    else ""
+                ),
+                "Pace": f"0:{random.randint(3, 9):02}:{random.randint(0, 59):02}",
+            }
+        )
+    return pd.DataFrame(results)
+
+
+def _coerce(df: pd.DataFrame) -> pd.DataFrame:
+    return coercion.coerce_columns(df)
+
+
+def _coerce_per_cell(df: pd.DataFrame) -> pd.DataFrame:
+    """The coercion _export_results used to do"""
+
+    for nc in coercion.get_columns(coercion.INTEGER):
+        if nc in df.columns:
+            df[nc] = df[nc].apply(lambda x: int(x) if x.isnumeric() else x)
+
+    for dtc in coercion.get_columns(coercion.DATETIME):
+        if dtc in df.columns:
+            df[dtc] = pd.to_datetime(df[dtc], errors="coerce").fillna(df[dtc])
+
+    for dc in coercion.get_columns(coercion.DURATION):
+        if dc in df.columns:
+            df[dc] = pd.to_timedelta(df[dc], errors="coerce").fillna(df[dc])
+
+    return df
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compares BeautifulSoup parser backends on saved result pages.
+
+Usage: python -m benchmarks.parsers saved_pages/*.html
+"""
+
+import argparse
+import timeit
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+PARSERS = ["html5lib", "html.parser", "lxml"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pages", nargs="+", help="Saved HTML pages")
+    parser.add_argument(
+        "-n",
+        "--number",
+        type=int,
+        default=5,
+        help="Number of parses per page and backend (default: 5)",
+    )
+    args = parser.parse_args()
+
+    backends = [p for p in PARSERS if _is_available(p)]
+    print(f"{'page':40} {'KiB':>8} " + " ".join(f"{b:>12}" for b in backends))
+
+    totals = dict.fromkeys(backends, 0.0)
+    for page in args.pages:
+        html = Path(page).read_text(encoding="utf-8", errors="replace")
+        timings = []
+        for backend in backends:
+            seconds = (
+                timeit.timeit(
+                    lambda b=backend: BeautifulSoup(html, b), number=args.number
+                )
+                / args.number
+            )
+            totals[backend] += seconds
+            timings.append(seconds)
+
+        print(
+            f"{Path(page).name[:40]:40} {len(html) / 1024:8.0f} "
+            + " ".join(f"{t * 1000:10.1f}ms" for t in timings)
+        )
+
+    baseline = totals[backends[0]]
+    print(
+        f"{'total (speedup vs ' + backends[0] + ')':49} "
+        + " ".join(f"{baseline / totals[b]:11.1f}x" for b in backends)
+    )
+
+
+def _is_available(parser: str) -> bool:
+    try:
+        BeautifulSoup("", parser)
+        return True
+    except Exception:
+        return False
+
+
+if __name__ == "__main__":
+    main()
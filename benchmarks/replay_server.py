@@ -0,0 +1,186 @@
+"""Serves recorded responses in place of the real results sites.
+
+Usage:
+    python main.py -u URL -o results.csv --record fixtures
+    python -m benchmarks.replay_server fixtures --port 8800 --latency 0.05
+    python main.py -u URL -o results.csv --no-cache --replay http://127.0.0.1:8800
+
+The transport sends the key of every request in a header, so a response is
+replayed for each request that was recorded, whichever host it was sent to.
+Latency and failing (e.g. 503) responses can be injected to exercise the
+concurrency, retry and backoff code.
+"""
+
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from loguru import logger
+
+from scrapers import cache
+from scrapers.transport import REPLAY_KEY_HEADER, REPLAY_URL_HEADER
+
+DEFAULT_PORT = 8800
+
+# Describe the stored body rather than the bytes that were sent, which
+# requests has already decompressed.
+SKIPPED_HEADERS = [
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+]
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        directory: str,
+        port: int = DEFAULT_PORT,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        error_status: int = 503,
+        retry_after: float = None,
+    ):
+        super().__init__(("127.0.0.1", port), ReplayHandler)
+        self.fixtures = cache.get_fixtures(directory)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.replayed = 0
+        self.missing = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._replay()
+
+    def do_POST(self):
+        self._replay()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _replay(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        server = self.server
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        if random.random() < server.error_rate:
+            server.count("errors")
+            headers = {}
+            if server.retry_after is not None:
+                headers["Retry-After"] = str(server.retry_after)
+            self._respond(server.error_status, headers, b"")
+            return
+
+        key = self.headers.get(REPLAY_KEY_HEADER)
+        entry = server.fixtures.get(key) if key else None
+        if entry is None:
+            server.count("missing")
+            logger.warning(f"No fixture for {self.headers.get(REPLAY_URL_HEADER)}")
+            self._respond(404, {}, b"")
+            return
+
+        server.count("replayed")
+        headers = {
+            k: v
+            for k, v in entry["headers"].items()
+            if k.lower() not in SKIPPED_HEADERS
+        }
+        self._respond(entry["status_code"], headers, entry["content"])
+
+    def _respond(self, status_code: int, headers: dict, content: bytes):
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def start(directory: str, **kwargs) -> ReplayServer:
+    """Starts a replay server in a background thread"""
+
+    server = ReplayServer(directory, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Seconds added to every response"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0,
+        help="Up to this many random seconds added to the latency",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0,
+        help="Fraction of requests answered with --error-status",
+    )
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        help="Retry-After seconds sent with injected errors",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", help="Directory recorded with main.py --record")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if not Path(args.fixtures).is_dir():
+        parser.error(f"{args.fixtures} is not a directory")
+
+    server = ReplayServer(
+        args.fixtures,
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+    )
+    logger.info(f"Replaying {args.fixtures} on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info(
+            f"Replayed {server.replayed} responses, {server.missing} missing, "
+            f"{server.errors} injected errors"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Benchmarks the scrapers and exporters against recorded responses.
+
+Usage:
+    python main.py -u URL -o results.csv --record fixtures
+    python -m benchmarks.scrape --fixtures fixtures URL [URL ...]
+
+Every URL is scraped from a local replay server (see replay_server.py), with
+optional latency and error injection, and the results of all URLs are then
+exported to every format. Parse and extract times are summed over all
+threads. Peak memory is measured in a second, traced run, since
+tracemalloc slows everything down.
+"""
+
+import argparse
+import importlib
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import Executor
+from pathlib import Path
+
+from loguru import logger
+
+import main as cli
+from benchmarks import replay_server
+from scrapers import metrics, scraper, transport
+from scrapers.scraper_factory import get_scraper
+
+EXPORT_FORMATS = ["csv", "csv.gz", "jsonl", "json", "xlsx", "parquet", "feather"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("urls", nargs="+", help="Race URLs that were recorded")
+    parser.add_argument(
+        "--fixtures", required=True, help="Directory recorded with main.py --record"
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("--parse-workers", type=int, default=0)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=EXPORT_FORMATS,
+        help=f"Export formats (default: {' '.join(EXPORT_FORMATS)})",
+    )
+    replay_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    # Every request and page is logged at DEBUG level
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    server = replay_server.start(
+        args.fixtures,
+        port=0,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+    )
+
+    print(
+        f"{'scraper':20} {'requests':>8} {'rows':>7} {'seconds':>8} "
+        f"{'req/s':>8} {'rows/s':>9} {'parse':>10} {'extract':>10} {'peak':>10}"
+    )
+    all_results = []
+    with scraper.get_parse_pool(args.parse_workers) as parse_pool:
+        for url in args.urls:
+            results, requests, seconds = _scrape(
+                url, server.url, args.concurrency, parse_pool
+            )
+            parse_seconds = _get_stage_seconds("parse")
+            extract_seconds = _get_stage_seconds("extract")
+            peak = _get_peak_memory(
+                lambda u=url: _scrape(u, server.url, args.concurrency, parse_pool)
+            )
+            all_results.extend(results)
+            print(
+                f"{type(get_scraper(url)).__name__:20} {requests:8} {len(results):7} "
+                f"{seconds:8.2f} {requests / seconds:8.1f} {len(results) / seconds:9.0f} "
+                f"{parse_seconds * 1000:8.0f}ms {extract_seconds * 1000:8.0f}ms "
+                f"{peak / 2**20:8.1f}MiB"
+            )
+
+    if server.missing > 0 or server.errors > 0:
+        print(f"{server.missing} missing fixtures, {server.errors} injected errors")
+
+    if len(all_results) == 0:
+        return
+
+    # main imports pandas and openpyxl on first use, which would otherwise be
+    # timed as part of the first export
+    importlib.import_module("exporters.coercion")
+    importlib.import_module("exporters.xlsx")
+
+    print()
+    print(
+        f"{'format':20} {'rows':>7} {'seconds':>8} {'rows/s':>9} {'size':>10} {'peak':>10}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for file_format in args.formats:
+            output_filename = str(Path(directory) / f"results.{file_format}")
+            seconds = _export(all_results, output_filename)
+            peak = _get_peak_memory(lambda f=output_filename: _export(all_results, f))
+            size = Path(output_filename).stat().st_size
+            print(
+                f"{file_format:20} {len(all_results):7} {seconds:8.2f} "
+                f"{len(all_results) / seconds:9.0f} {size / 2**10:8.0f}KiB "
+                f"{peak / 2**20:8.1f}MiB"
+            )
+
+
+def _scrape(
+    url: str, replay_url: str, concurrency: int, parse_pool: Executor = None
+) -> tuple:
+    """Returns the results, the number of requests and the time taken to
+    scrape `url` from the replay server"""
+
+    http = transport.configure(
+        pool_maxsize=concurrency, max_in_flight=concurrency, replay_url=replay_url
+    )
+    metrics.reset()
+
+    start = time.perf_counter()
+    race_scraper = get_scraper(url, concurrency)
+    race_scraper.parse_pool = parse_pool
+    results = race_scraper.get_results()
+    return results, http.request_count, time.perf_counter() - start
+
+
+def _get_stage_seconds(stage: str) -> float:
+    return sum(
+        histogram.sum
+        for (histogram_stage, _), histogram in metrics.get_metrics().histograms.items()
+        if histogram_stage == stage
+    )
+
+
+def _export(results: list, output_filename: str) -> float:
+    # The exporters drop columns from the results they are given
+    results = [dict(result) for result in results]
+
+    start = time.perf_counter()
+    cli.export(results, output_filename)
+    return time.perf_counter() - start
+
+
+def _get_peak_memory(func) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    main()
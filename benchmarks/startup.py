@@ -0,0 +1,84 @@
+"""Measures how long the CLI takes to start, i.e. to import main.
+
+Usage: python -m benchmarks.startup [--target 250]
+
+Each run imports main in a fresh interpreter. The exit status is 1 when the
+median import time exceeds the target, so this can run in CI.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules that should only be imported once they are needed
+DEFERRED_MODULES = ["pandas", "openpyxl", "pyarrow", "html5lib"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=5)
+    parser.add_argument(
+        "--target",
+        type=float,
+        default=250,
+        help="Maximum median import time in milliseconds (default: 250)",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports to list"
+    )
+    args = parser.parse_args()
+
+    runs = [_import_main() for _ in range(args.number)]
+    median = statistics.median(total for total, _ in runs)
+
+    print(f"{'module':50} {'cumulative':>12}")
+    _, modules = runs[-1]
+    for module, microseconds in sorted(modules.items(), key=lambda m: -m[1])[
+        : args.top
+    ]:
+        print(f"{module:50} {microseconds / 1000:10.1f}ms")
+
+    for module in DEFERRED_MODULES:
+        if module in modules:
+            print(f"warning: {module} is imported at startup")
+
+    print(
+        f"import main: {median:.1f}ms median of {args.number} (target {args.target:.0f}ms)"
+    )
+    sys.exit(0 if median <= args.target else 1)
+
+
+def _import_main() -> tuple:
+    """Returns the import time of main in milliseconds and the cumulative
+    import time of every module in microseconds"""
+
+    # Imported from an empty directory, so that only PYTHONPATH puts the
+    # repository on the path
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=directory,
+            env={**os.environ, "PYTHONPATH": str(ROOT)},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        modules[module.strip()] = int(cumulative)
+
+    return modules["main"] / 1000, modules
+
+
+if __name__ == "__main__":
+    main()
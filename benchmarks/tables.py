@@ -0,0 +1,162 @@
+"""Compares the shared table extractor with the per-scraper row loops it replaced.
+
+Usage: python -m benchmarks.tables [--rows 10000]
+"""
+
+import argparse
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+
+from scrapers import scraper, table
+from scrapers.bouttime_scraper import _split_name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("-n", "--number", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [
+        ("finishtime", _make_finishtime_table, _extract_finishtime, _extract_table),
+        ("bouttime", _make_bouttime_table, _extract_bouttime, _extract_bouttime_table),
+        (
+            "ultimate.dk",
+            _make_ultimate_table,
+            _extract_ultimate,
+            _extract_ultimate_table,
+        ),
+    ]
+    print(f"{'table':12} {'rows':>7} {'per-scraper':>12} {'shared':>12} {'speedup':>8}")
+    for name, make_table, extract_old, extract_new in cases:
+        soup = BeautifulSoup(make_table(args.rows), scraper.FAST_PARSER)
+        results_table = soup.find("table")
+        if list(extract_old(results_table)) != list(extract_new(results_table)):
+            raise AssertionError(f"{name}: the extractors disagree")
+
+        old, new = [
+            timeit.timeit(lambda e=e: list(e(results_table)), number=args.number)
+            / args.number
+            for e in [extract_old, extract_new]
+        ]
+        print(
+            f"{name:12} {args.rows:7} {old * 1000:10.1f}ms {new * 1000:10.1f}ms "
+            f"{old / new:7.1f}x"
+        )
+
+
+def _make_finishtime_table(rows: int) -> str:
+    header = (
+        "<tr><th>Pos</th><th>Race No</th><th>Name</th><th>Time</th>"
+        '<th class="d-xs-table-cell">Fav</th></tr>'
+    )
+    body = "".join(
+        f"<tr><th>{i}</th><td>{1000 + i}</td><td><a href='#'>Runner {i}</a></td>"
+        f"<td> 1:{i % 60:02d}:{i % 60:02d} </td><td class='d-xs-table-cell'>x</td></tr>"
+        for i in range(1, rows + 1)
+    )
+    return f"<html><body><table>{header}{body}</table></body></html>"
+
+
+def _make_bouttime_table(rows: int) -> str:
+    header = "<tr><th>Pos</th><th>Name</th><th>Club</th><th>Time</th></tr>"
+    body = "".join(
+        f"<tr><th>{i}</th><td>Rider {i} (L{i:05d})</td><td>Club {i % 30}</td>"
+        f"<td>2:{i % 60:02d}:{i % 60:02d}</td></tr>"
+        for i in range(1, rows + 1)
+    )
+    return f"<html><body><table>{header}{body}</table></body></html>"
+
+
+def _make_ultimate_table(rows: int) -> str:
+    header = "<tr><td>Pos</td><td>Bib</td><td>Name</td><td>Time</td></tr>"
+    body = "".join(
+        f"<tr><td>{i}</td><td>{i}</td><td><span>Runner</span> {i}</td>"
+        f"<td>0:{i % 60:02d}:{i % 60:02d}</td></tr>"
+        for i in range(1, rows + 1)
+    )
+    return f"<html><body><table>{header}{body}</table></body></html>"
+
+
+def _extract_table(results_table):
+    return table.extract_table(results_table, hidden_class=table.HIDDEN_CLASS)
+
+
+def _extract_bouttime_table(results_table):
+    return table.extract_table(
+        results_table,
+        hidden_class=table.HIDDEN_CLASS,
+        initial={"RaceName": "Race", "EventName": "Event"},
+        split_columns={"Name": _split_name},
+    )
+
+
+def _extract_ultimate_table(results_table):
+    return table.extract_table(
+        results_table, header_cell="td", body_cells=("td",), recursive=True
+    )
+
+
+def _extract_finishtime(results_table):
+    rows = results_table.find_all("tr")
+    header_row = rows[0]
+    headers = dict(
+        (index, table.propercase_and_remove_spaces(th.text))
+        for index, th in enumerate(header_row.find_all("th"))
+        if "d-xs-table-cell" not in th.get("class", [])
+    )
+    for row in rows[1:]:
+        cells = [child for child in row.children if child.name in ["td", "th"]]
+        result = {}
+        for index, cell in enumerate(cells):
+            if index in headers:
+                result[headers[index]] = cell.text.strip()
+
+        yield result
+
+
+def _extract_bouttime(results_table):
+    rows = results_table.find_all("tr")
+    header_row = rows[0]
+    headers = dict(
+        (index, table.propercase_and_remove_spaces(th.text))
+        for index, th in enumerate(header_row.find_all("th"))
+        if "d-xs-table-cell" not in th.get("class", [])
+    )
+    for row in rows[1:]:
+        cells = [child for child in row.children if child.name in ["td", "th"]]
+        result = {"RaceName": "Race", "EventName": "Event"}
+        for index, cell in enumerate(cells):
+            if index in headers:
+                text = cell.text.strip()
+                if headers[index] == "Name" and "(" in text:
+                    match = re.match(r"(.*)\s\((.*)\)", text)
+                    result["Name"] = match.group(1)
+                    result["LicenseNr"] = match.group(2)
+                else:
+                    result[headers[index]] = text
+
+        yield result
+
+
+def _extract_ultimate(results_table):
+    rows = results_table.find_all("tr")
+    header_row = rows[0]
+    headers = dict(
+        (index, table.propercase_and_remove_spaces(td.text))
+        for index, td in enumerate(header_row.find_all("td"))
+    )
+    for row in rows[1:]:
+        cells = row.select("td")
+        result = {}
+        for index, cell in enumerate(cells):
+            if index in headers:
+                result[headers[index]] = cell.text.strip()
+
+        yield result
+
+
+if __name__ == "__main__":
+    main()
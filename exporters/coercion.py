@@ -0,0 +1,125 @@
+import datetime
+import math
+import re
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+INTEGER = "integer"
+DATETIME = "datetime"
+DURATION = "duration"
+
+SCHEMA = {
+    "Pos": INTEGER,
+    "CatPos": INTEGER,
+    "GenPos": INTEGER,
+    "GenPts": INTEGER,
+    "Rank": INTEGER,
+    "StartTime": DATETIME,
+    "Time": DURATION,
+    "Finish": DURATION,
+    "ResultTime": DURATION,
+    "Pace": DURATION,
+}
+
+# h:mm:ss, mm:ss and either with fractional seconds
+DURATION_REGEX = re.compile(r"^\s*(?:(\d+):)?(\d{1,2}):(\d{1,2}(?:\.\d+)?)\s*$")
+_match_duration = DURATION_REGEX.match
+
+
+def coerce_columns(
+    df: pd.DataFrame, schema: dict = None, strict: bool = False
+) -> pd.DataFrame:
+    """Converts the columns in `schema` to their declared type.
+
+    A column becomes fully typed when every non-blank value converts. Values
+    that don't convert (e.g. DNF in a position column) are kept as they are,
+    which leaves that column with mixed types, unless `strict` is set: they
+    are then replaced by missing values.
+    """
+    schema = SCHEMA if schema is None else schema
+    for column, column_type in schema.items():
+        if column in df.columns:
+            df[column] = _COERCERS[column_type](df[column], strict)
+
+    return df
+
+
+def get_columns(column_type: str, schema: dict = None) -> list:
+    schema = SCHEMA if schema is None else schema
+    return [c for c, t in schema.items() if t == column_type]
+
+
+def _to_integer(values: pd.Series, strict: bool = False) -> pd.Series:
+    if pd.api.types.is_integer_dtype(values):
+        return values
+
+    text = values.astype("string")
+    is_converted = text.str.isdecimal().fillna(False).astype(bool)
+    integers = pd.Series(pd.NA, index=values.index, dtype="Int64")
+    integers[is_converted] = text[is_converted].astype("int64")
+    return _combine(values, integers, is_converted, strict)
+
+
+def _to_datetime(values: pd.Series, strict: bool = False) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+
+    timestamps = pd.to_datetime(values, errors="coerce")
+    return _combine(values, timestamps, timestamps.notna(), strict)
+
+
+def _to_duration(values: pd.Series, strict: bool = False) -> pd.Series:
+    if pd.api.types.is_timedelta64_dtype(values):
+        return values
+
+    # Matching the precompiled pattern and building an array of seconds is
+    # much cheaper than letting pd.to_timedelta parse every string.
+    seconds = np.fromiter(
+        (_get_seconds(v) for v in values.to_numpy()), dtype="float64", count=len(values)
+    )
+    durations = pd.Series(pd.to_timedelta(seconds, unit="s"), index=values.index)
+    return _combine(values, durations, durations.notna(), strict)
+
+
+def _get_seconds(value) -> float:
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+
+    match = _match_duration(value) if isinstance(value, str) else None
+    if match is None:
+        return math.nan
+
+    hours, minutes, seconds = match.groups()
+    return (int(hours) * 3600 if hours else 0) + int(minutes) * 60 + float(seconds)
+
+
+def _combine(
+    values: pd.Series,
+    converted: pd.Series,
+    is_converted: pd.Series,
+    strict: bool = False,
+) -> pd.Series:
+    rest = values[~is_converted]
+    if rest.isna().all() or (rest.astype("string").str.strip() == "").all():
+        return converted.where(is_converted)
+
+    if strict:
+        logger.warning(
+            f"Dropping {rest.notna().sum()} values of {values.name} "
+            f"that are not {converted.dtype}: {', '.join(rest.astype(str).unique()[:5])}"
+        )
+        return converted.where(is_converted)
+
+    mask = is_converted.to_numpy()
+    combined = values.to_numpy(dtype=object, copy=True)
+    combined[mask] = converted.to_numpy(dtype=object)[mask]
+    return pd.Series(combined, index=values.index, dtype=object)
+
+
+_COERCERS = {
+    INTEGER: _to_integer,
+    DATETIME: _to_datetime,
+    DURATION: _to_duration,
+}
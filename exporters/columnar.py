@@ -0,0 +1,45 @@
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FORMATS = ["parquet", "feather", "arrow"]
+DEFAULT_COMPRESSION = {"parquet": "zstd", "feather": "zstd", "arrow": "zstd"}
+# Codecs supported by pyarrow for each format, besides "none"
+COMPRESSIONS = {
+    "parquet": ["snappy", "gzip", "brotli", "lz4", "zstd", "none"],
+    "feather": ["lz4", "zstd", "none"],
+    "arrow": ["lz4", "zstd", "none"],
+}
+
+
+def write_columnar(
+    df: "pd.DataFrame", output_filename: str, file_format: str, compression: str = None
+):
+    """Writes results as Parquet or Arrow IPC (Feather v2), with typed columns.
+
+    `df` is expected to have been coerced strictly, so that every column has
+    a single type. Any remaining mixed object columns are written as strings.
+    """
+    try:
+        import pyarrow  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        logger.error(f"Writing {file_format} files requires pyarrow to be installed")
+        return
+
+    compression = (
+        DEFAULT_COMPRESSION[file_format] if compression is None else compression
+    )
+    if compression == "none":
+        compression = None if file_format == "parquet" else "uncompressed"
+
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].astype("string")
+
+    if file_format == "parquet":
+        df.to_parquet(output_filename, index=False, compression=compression)
+    else:
+        df.to_feather(output_filename, compression=compression)
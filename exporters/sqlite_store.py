@@ -0,0 +1,184 @@
+import datetime
+import json
+import re
+import sqlite3
+import threading
+from urllib.parse import parse_qsl, urlparse
+
+from exporters.streaming import DROPPED_COLUMNS
+
+# Columns identifying a result within an event, in order of preference. When
+# none is present, the position and name are used.
+KEY_COLUMNS = ["Bib", "BibNumber", "BibNo", "RaceNo", "No"]
+POSITION_COLUMNS = ["Pos", "CoursePosition"]
+
+# Query parameters identifying a race in the source URL, compared in lower
+# case (Finishtime's CId and RId, Ultimate.dk's eventid). MobiiElite has the
+# race id in the path instead.
+RACE_ID_PARAMETERS = ["cid", "rid", "eventid"]
+RACE_ID_PATH_REGEX = re.compile(r"/RaceID/([^/]+)", re.IGNORECASE)
+
+COMMIT_INTERVAL = 1000
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS results (
+    source_host TEXT NOT NULL,
+    race_id TEXT NOT NULL,
+    race_name TEXT NOT NULL,
+    event_name TEXT NOT NULL,
+    result_key TEXT NOT NULL,
+    name TEXT,
+    license_nr TEXT,
+    data TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (source_host, race_id, event_name, result_key)
+);
+"""
+
+CREATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS results_race_name ON results (race_name);
+CREATE INDEX IF NOT EXISTS results_event_name ON results (event_name);
+CREATE INDEX IF NOT EXISTS results_name ON results (name);
+CREATE INDEX IF NOT EXISTS results_license_nr ON results (license_nr);
+"""
+
+# Databases created before results were keyed by race id keep the race name
+# as the id of their races
+ADD_RACE_ID = f"""
+ALTER TABLE results RENAME TO results_by_race_name;
+DROP INDEX IF EXISTS results_race_name;
+DROP INDEX IF EXISTS results_event_name;
+DROP INDEX IF EXISTS results_name;
+DROP INDEX IF EXISTS results_license_nr;
+{CREATE_TABLE}
+INSERT INTO results
+SELECT source_host, race_name, race_name, event_name, result_key, name, license_nr,
+    data, updated_at
+FROM results_by_race_name;
+DROP TABLE results_by_race_name;
+"""
+
+UPSERT = """
+INSERT INTO results (
+    source_host, race_id, race_name, event_name, result_key, name, license_nr, data,
+    updated_at
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (source_host, race_id, event_name, result_key) DO UPDATE SET
+    race_name = excluded.race_name,
+    name = excluded.name,
+    license_nr = excluded.license_nr,
+    data = excluded.data,
+    updated_at = excluded.updated_at
+"""
+
+
+class ResultStore:
+    """A SQLite database of results from every run.
+
+    Results are upserted by (source host, race id, event, bib or position),
+    so scraping a race again updates its results instead of duplicating them.
+    The race id is taken from the source URL, as editions of a race may share
+    its name. The full result is kept as JSON in the `data` column.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(results)")
+        ]
+        if len(columns) > 0 and "race_id" not in columns:
+            self.connection.executescript(ADD_RACE_ID)
+        self.connection.executescript(CREATE_TABLE + CREATE_INDEXES)
+        self._lock = threading.Lock()
+
+    def passthrough(self, results, source_url: str):
+        """Stores results while passing them on, e.g. to a streaming export"""
+
+        source_host = _get_source_host(source_url)
+        race_id = _get_race_id(source_url)
+        pending = 0
+        for result in results:
+            self._upsert(source_host, race_id, result)
+            pending += 1
+            if pending >= COMMIT_INTERVAL:
+                self._commit()
+                pending = 0
+            yield result
+
+        self._commit()
+
+    def store(self, results, source_url: str) -> int:
+        count = 0
+        for _ in self.passthrough(results, source_url):
+            count += 1
+        return count
+
+    def close(self):
+        self.connection.close()
+
+    def _upsert(self, source_host: str, race_id: str, result: dict):
+        data = {k: v for k, v in result.items() if k not in DROPPED_COLUMNS}
+        with self._lock:
+            self.connection.execute(
+                UPSERT,
+                (
+                    source_host,
+                    race_id,
+                    result.get("RaceName", ""),
+                    result.get("EventName", ""),
+                    _get_result_key(result),
+                    _get_name(result),
+                    result.get("LicenseNr"),
+                    json.dumps(data, default=str, ensure_ascii=False),
+                    datetime.datetime.now().isoformat(timespec="seconds"),
+                ),
+            )
+
+    def _commit(self):
+        with self._lock:
+            self.connection.commit()
+
+
+def _get_source_host(url: str) -> str:
+    hostname = (urlparse(url).hostname or "").lower()
+    if hostname.startswith("www."):
+        hostname = hostname[4:]
+    return hostname
+
+
+def _get_race_id(url: str) -> str:
+    parsed_url = urlparse(url)
+    parameters = {k.lower(): v for k, v in parse_qsl(parsed_url.query)}
+    race_id = "&".join(
+        f"{name}={parameters[name]}"
+        for name in RACE_ID_PARAMETERS
+        if name in parameters
+    )
+    if race_id != "":
+        return race_id
+
+    match = RACE_ID_PATH_REGEX.search(parsed_url.path)
+    if match is not None:
+        return match.group(1).lower()
+
+    # Any other race is identified by its full URL
+    return parsed_url.path + (f"?{parsed_url.query}" if parsed_url.query else "")
+
+
+def _get_result_key(result: dict) -> str:
+    for column in KEY_COLUMNS:
+        if result.get(column) not in (None, ""):
+            return f"{column}:{result[column]}"
+
+    # Positions repeat for DNF/DNS, so the name is part of the key
+    position = next((result[c] for c in POSITION_COLUMNS if c in result), "")
+    return f"Pos:{position}:{_get_name(result) or ''}"
+
+
+def _get_name(result: dict) -> str:
+    if result.get("Name"):
+        return result["Name"]
+
+    name = " ".join(str(result[c]) for c in ["FirstName", "LastName"] if result.get(c))
+    return name or None
@@ -0,0 +1,129 @@
+import csv
+import gzip
+import io
+import json
+import time
+
+from loguru import logger
+
+from scrapers import metrics
+
+DROPPED_COLUMNS = ["Fav", "Share", "Behind", ""]
+LEADING_COLUMNS = ["RaceName", "EventName"]
+TEXT_FORMATS = ["csv", "json", "jsonl"]
+COMPRESSIONS = ["gz", "zst"]
+
+
+def export_results(results, output_filename: str) -> int:
+    """Writes results to a CSV or JSON Lines file as they arrive.
+
+    Only one result is held in memory at a time. Returns the number of results
+    written.
+    """
+    file_extension = get_file_extension(output_filename)
+    if file_extension == "csv":
+        return _write_csv(results, output_filename)
+    if file_extension == "jsonl":
+        return _write_jsonl(results, output_filename)
+
+    logger.error(f"Streaming export is not supported for: {file_extension}")
+    return 0
+
+
+def _write_csv(results, output_filename: str) -> int:
+    count = 0
+    seconds = 0.0
+    writer = None
+    ignored_columns = set()
+    with open_output(output_filename) as f:
+        for result in results:
+            # Only the writing is timed, not the scraping of the next result
+            start = time.perf_counter()
+            if writer is None:
+                # The header is taken from the first result, as there is no
+                # going back to add columns later on.
+                # pandas writes "\n" line endings, not the csv module's "\r\n"
+                writer = csv.DictWriter(
+                    f,
+                    fieldnames=_get_columns(result),
+                    extrasaction="ignore",
+                    lineterminator="\n",
+                )
+                writer.writeheader()
+
+            for column in result.keys() - writer.fieldnames - ignored_columns:
+                if column not in DROPPED_COLUMNS:
+                    logger.warning(f"Ignoring column not in the header: {column}")
+                ignored_columns.add(column)
+
+            writer.writerow(result)
+            count += 1
+            seconds += time.perf_counter() - start
+
+    _observe_export("csv", count, seconds)
+    if count == 0:
+        logger.error("No results to export")
+
+    return count
+
+
+def _write_jsonl(results, output_filename: str) -> int:
+    count = 0
+    seconds = 0.0
+    with open_output(output_filename) as f:
+        for result in results:
+            start = time.perf_counter()
+            # Same column order and dropped columns as the other exports
+            result = {column: result[column] for column in _get_columns(result)}
+            f.write(json.dumps(result, default=str, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+            seconds += time.perf_counter() - start
+
+    _observe_export("jsonl", count, seconds)
+    if count == 0:
+        logger.error("No results to export")
+
+    return count
+
+
+def _observe_export(file_format: str, count: int, seconds: float):
+    metrics.get_metrics().observe("export", file_format, seconds)
+    metrics.increment("exported_rows", file_format, count)
+
+
+def _get_columns(result: dict) -> list:
+    columns = [c for c in result.keys() if c not in DROPPED_COLUMNS]
+    if all(c in columns for c in LEADING_COLUMNS):
+        columns = LEADING_COLUMNS + [c for c in columns if c not in LEADING_COLUMNS]
+
+    return columns
+
+
+def get_file_extension(output_filename: str) -> str:
+    """Returns the format of an output file, ignoring a compression extension"""
+
+    extensions = output_filename.lower().split(".")
+    if len(extensions) > 2 and extensions[-1] in COMPRESSIONS:
+        return extensions[-2]
+    return extensions[-1]
+
+
+def get_compression(output_filename: str) -> str:
+    compression = output_filename.lower().split(".")[-1]
+    return compression if compression in COMPRESSIONS else None
+
+
+def open_output(output_filename: str):
+    """Opens a text output file, compressed according to its extension"""
+
+    compression = get_compression(output_filename)
+    if compression == "gz":
+        return gzip.open(output_filename, "wt", newline="", encoding="utf-8")
+    if compression == "zst":
+        import zstandard  # pylint: disable=import-outside-toplevel
+
+        writer = zstandard.ZstdCompressor().stream_writer(open(output_filename, "wb"))
+        return io.TextIOWrapper(writer, newline="", encoding="utf-8")
+
+    return open(output_filename, "w", newline="", encoding="utf-8")
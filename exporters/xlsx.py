@@ -0,0 +1,78 @@
+import math
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+DURATION_FORMAT = "hh:mm:ss.000"
+
+# Column widths are estimated from a random sample of this many rows on large
+# sheets. Set to None to measure every row.
+WIDTH_SAMPLE_SIZE = 10000
+
+
+def write_xlsx(df: pd.DataFrame, output_filename: str, duration_columns: list):
+    """Writes results to a single sheet in one pass over the rows.
+
+    The workbook is created in write-only mode, so rows are streamed to disk
+    instead of being kept as cells in memory. Column widths and formats are
+    set up before the first row is written.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Results")
+
+    widths = _get_column_widths(df, duration_columns, WIDTH_SAMPLE_SIZE)
+    for index, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(index)].width = width
+
+    header = []
+    for column in df.columns:
+        cell = WriteOnlyCell(ws, value=column)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    ws.append(header)
+
+    duration_indexes = [
+        index for index, column in enumerate(df.columns) if column in duration_columns
+    ]
+    for row in df.itertuples(index=False, name=None):
+        values = [_get_cell_value(value) for value in row]
+        for index in duration_indexes:
+            if values[index] is not None:
+                cell = WriteOnlyCell(ws, value=values[index])
+                cell.number_format = DURATION_FORMAT
+                values[index] = cell
+        ws.append(values)
+
+    wb.save(output_filename)
+
+
+def _get_cell_value(value):
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _get_column_widths(
+    df: pd.DataFrame, duration_columns: list, sample_size: int = None
+) -> list:
+    if sample_size is not None and len(df) > sample_size:
+        df = df.sample(n=sample_size, random_state=0)
+
+    widths = []
+    for column in df.columns:
+        if column in duration_columns:
+            # Durations are displayed in DURATION_FORMAT, whatever their str()
+            max_length = len(DURATION_FORMAT)
+        else:
+            max_length = df[column].astype("string").str.len().max()
+            max_length = 0 if pd.isna(max_length) else int(max_length)
+
+        max_length = max(max_length, len(str(column)))
+        widths.append((max_length + 2) * 1.1)
+
+    return widths
@@ -1,115 +1,440 @@
 import argparse
+import cProfile
+import io
+import pstats
+import time
+from concurrent.futures import Executor
+from pathlib import Path
 
-import pandas as pd
 from loguru import logger
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.worksheet import Worksheet
 
+from exporters import columnar, streaming
+from exporters.sqlite_store import ResultStore
+from scrapers import cache, metrics, ratelimit, transport
+from scrapers.checkpoint import CheckpointStore
 from scrapers.scraper_factory import get_scraper
 
-logger.add("log.txt", rotation="500 MB", level="DEBUG")
+PROFILE_LIMIT = 30
 
 
 def main():
+    # Only the CLI logs to a file, not the benchmarks importing this module
+    logger.add("log.txt", rotation="500 MB", level="DEBUG")
+
     parser = argparse.ArgumentParser(
         description="A utility to extract results from finishtime.co.za and dump it to a file."
     )
 
     parser.add_argument("-u", "--url", help="Exact full url on finishtime")
+    parser.add_argument(
+        "-b",
+        "--batch",
+        metavar="FILE",
+        help="File with one race url per line to scrape in a single run",
+    )
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="Write all races of a batch to the output file instead of one "
+        "numbered output file per race",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of races of a batch to scrape in parallel (default: 1). "
+        "At least this many requests run in parallel, even if --concurrency "
+        "is lower",
+    )
     parser.add_argument(
         "-o",
         "--output",
         type=str,
         default="results.csv",
-        help="Output file (default: results.csv)",
+        help="Output file (default: results.csv). csv, json and jsonl output "
+        "is compressed when the name ends in .gz or .zst",
+    )
+    parser.add_argument(
+        "--compression",
+        help="Compression codec for parquet (snappy, gzip, brotli, lz4, zstd, "
+        "none) and feather/arrow (lz4, zstd, none) output (default: zstd)",
+    )
+    parser.add_argument(
+        "--sqlite",
+        metavar="DATABASE",
+        help="Also upsert the results into this SQLite database",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write csv rows as they are downloaded instead of collecting all "
+        "results first. The columns are taken from the first result. "
+        "jsonl output is always streamed.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted crawl from its checkpoint instead of "
+        "downloading every page again",
+    )
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help="Keep polling live results at this interval and re-export the "
+        "output whenever they change (MobiiElite only)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of requests to run in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="Number of processes parsing pages while --concurrency threads "
+        "download them (default: 0, parse in the downloading threads)",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        help="Maximum number of parallel requests to a single host",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=transport.DEFAULT_POOL_MAXSIZE,
+        help=f"Maximum connections kept open per host (default: {transport.DEFAULT_POOL_MAXSIZE})",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=transport.DEFAULT_TIMEOUT,
+        help=f"HTTP request timeout in seconds (default: {transport.DEFAULT_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Maximum number of requests per second to a single host",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=transport.DEFAULT_MAX_RETRIES,
+        help="Number of times a failed or throttled request is retried "
+        f"(default: {transport.DEFAULT_MAX_RETRIES})",
+    )
+    parser.add_argument(
+        "--cache",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Serve repeated requests from an on-disk response cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=cache.DEFAULT_CACHE_DIRECTORY,
+        help=f"Response cache directory (default: {cache.DEFAULT_CACHE_DIRECTORY})",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIRECTORY",
+        help="Record every response as a fixture for benchmarks/replay_server.py",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="URL",
+        help="Send all requests to this replay server, "
+        "e.g. http://127.0.0.1:8800 (see benchmarks/replay_server.py)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Write fetch/parse/extract/export timings to this file, as JSON "
+        "for .json and as a Prometheus textfile otherwise",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Run under cProfile and log the hot functions. Only the main thread "
+        "is profiled, so use --concurrency 1 to include fetching and parsing",
     )
 
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.parse_workers < 0:
+        parser.error("--parse-workers must not be negative")
+    if args.compression is not None:
+        # Checked up front, as pyarrow would only reject it after scraping
+        file_extension = streaming.get_file_extension(args.output)
+        if file_extension not in columnar.COMPRESSIONS:
+            parser.error(
+                "--compression only applies to parquet and feather/arrow output"
+            )
+        if args.compression not in columnar.COMPRESSIONS[file_extension]:
+            parser.error(
+                f"--compression for {file_extension} output must be one of: "
+                f"{', '.join(columnar.COMPRESSIONS[file_extension])}"
+            )
+    if args.watch is not None:
+        if args.url is None or args.batch is not None:
+            parser.error("--watch needs a single --url")
+        if not get_scraper(args.url).supports_watch:
+            parser.error(f"--watch is not supported for {args.url}")
+
+    # Every race of a batch needs a request slot to make progress
+    max_in_flight = max(args.concurrency, args.jobs)
+    http = transport.configure(
+        pool_maxsize=max(args.pool_size, max_in_flight),
+        timeout=args.timeout,
+        max_in_flight=max_in_flight,
+        max_per_host=args.max_per_host,
+        rate_limiter=ratelimit.RateLimiter(args.rate) if args.rate else None,
+        max_retries=args.retries,
+        cache=cache.ResponseCache(args.cache_dir) if args.cache else None,
+        recorder=cache.get_fixtures(args.record) if args.record else None,
+        replay_url=args.replay,
+    )
+
+    store = ResultStore(args.sqlite) if args.sqlite else None
+
+    # scrapers.scraper imports bs4, which is only needed once there is
+    # something to scrape
+    from scrapers.scraper import (  # pylint: disable=import-outside-toplevel
+        get_parse_pool,
+    )
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
 
-    if args.url is not None:
-        scraper = get_scraper(args.url)
-        results = scraper.get_results()
-        _export_results(results, args.output)
+    try:
+        # One pool parses the pages of every race, as its workers are slow
+        # to start
+        with get_parse_pool(args.parse_workers) as parse_pool:
+            _run(args, store, parse_pool)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _log_profile(profiler)
+        if store is not None:
+            store.close()
+
+    http.log_connection_stats()
+    metrics.get_metrics().log_summary()
+    if args.metrics_file:
+        metrics.get_metrics().write(args.metrics_file)
+
+
+def _run(args, store: ResultStore = None, parse_pool: Executor = None):
+    if args.batch is not None:
+        _run_batch(args, store, parse_pool)
+    elif args.url is not None:
+        race_scraper = get_scraper(args.url, args.concurrency)
+        race_scraper.parse_pool = parse_pool
+        file_extension = streaming.get_file_extension(args.output)
+        if args.watch is not None:
+
+            def on_change(results):
+                if store is not None:
+                    store.store(results, args.url)
+                export(results, args.output, args.compression)
+
+            try:
+                race_scraper.watch(args.watch, on_change)
+            except KeyboardInterrupt:
+                logger.info("Stopped watching")
+        else:
+            race_scraper.checkpoint = _open_checkpoint(
+                race_scraper, args.output, args.resume
+            )
+            try:
+                results = race_scraper.iter_results()
+                if store is not None:
+                    results = store.passthrough(results, args.url)
+
+                if file_extension == "jsonl" or (
+                    args.stream and file_extension == "csv"
+                ):
+                    streaming.export_results(results, args.output)
+                else:
+                    results = list(results)
+                    _export_results(results, args.output, args.compression)
+
+                # Failed pages raise, so a completed crawl has nothing to resume
+                _remove_checkpoint(race_scraper.checkpoint)
+            finally:
+                _close_checkpoint(race_scraper.checkpoint)
+
+
+def _run_batch(args, store: ResultStore = None, parse_pool: Executor = None):
+    with open(args.batch, encoding="utf-8") as f:
+        urls = [
+            line.strip()
+            for line in f
+            if line.strip() != "" and not line.strip().startswith("#")
+        ]
+
+    def scrape_race(race):
+        index, url = race
+        start = time.perf_counter()
+        try:
+            output_filename = _get_batch_output_filename(args.output, index)
+            race_scraper = get_scraper(url, args.concurrency)
+            race_scraper.parse_pool = parse_pool
+            race_scraper.checkpoint = _open_checkpoint(
+                race_scraper, output_filename, args.resume
+            )
+            try:
+                results = race_scraper.get_results()
+                if len(results) == 0:
+                    _remove_checkpoint(race_scraper.checkpoint)
+                    return [], "No results", time.perf_counter() - start
+                if store is not None:
+                    store.store(results, url)
+                if not args.combined:
+                    export(results, output_filename, args.compression)
+                _remove_checkpoint(race_scraper.checkpoint)
+                return results, None, time.perf_counter() - start
+            finally:
+                _close_checkpoint(race_scraper.checkpoint)
+        except Exception as e:
+            logger.error(f"Failed to scrape {url}: {e}")
+            return [], e, time.perf_counter() - start
+
+    from scrapers import scraper  # pylint: disable=import-outside-toplevel
+
+    # Races share the transport, so --concurrency (or --jobs, if higher) and
+    # --max-per-host apply to the whole batch.
+    combined_results = []
+    failures = 0
+    races = scraper.map_ordered(scrape_race, enumerate(urls, 1), args.jobs)
+    for url, (results, error, seconds) in zip(urls, races):
+        if error is None:
+            logger.info(f"{url}: {len(results)} results in {seconds:.1f}s")
+        else:
+            failures += 1
+            logger.error(f"{url}: failed after {seconds:.1f}s - {error}")
+
+        if args.combined:
+            combined_results.extend(results)
+
+    logger.info(f"Scraped {len(urls) - failures} of {len(urls)} races")
+
+    if args.combined:
+        export(combined_results, args.output, args.compression)
+
+
+def _log_profile(profiler: cProfile.Profile):
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_LIMIT)
+    logger.info(f"Hot functions:\n{output.getvalue()}")
+
+
+def _open_checkpoint(
+    race_scraper, output_filename: str, resume: bool
+) -> CheckpointStore:
+    """Returns the checkpoint of a crawl, or None if the scraper doesn't
+    record its progress"""
+
+    if not race_scraper.uses_checkpoint:
+        return None
 
+    checkpoint_filename = f"{output_filename}.checkpoint.jsonl"
+    if not resume and Path(checkpoint_filename).exists():
+        logger.warning(
+            f"Overwriting {checkpoint_filename}, use --resume to continue from it"
+        )
+    return CheckpointStore(checkpoint_filename, resume)
 
-def _export_results(results: list, output_filename: str):
+
+def _remove_checkpoint(checkpoint: CheckpointStore):
+    if checkpoint is not None:
+        checkpoint.remove()
+
+
+def _close_checkpoint(checkpoint: CheckpointStore):
+    if checkpoint is not None:
+        checkpoint.close()
+
+
+def _get_batch_output_filename(output_filename: str, index: int) -> str:
+    path = Path(output_filename)
+    return str(path.with_name(f"{path.stem}_{index:03d}{path.suffix}"))
+
+
+def export(results: list, output_filename: str, compression: str = None):
+    """Writes the results to a file in the format of its extension"""
+
+    if streaming.get_file_extension(output_filename) == "jsonl":
+        streaming.export_results(results, output_filename)
+    else:
+        _export_results(results, output_filename, compression)
+
+
+def _export_results(results: list, output_filename: str, compression: str = None):
     if len(results) == 0:
         logger.error("No results to export")
         return
 
+    file_extension = streaming.get_file_extension(output_filename)
+    with metrics.timed("export", file_extension):
+        _write_results(results, output_filename, compression)
+    metrics.increment("exported_rows", file_extension, len(results))
+
+
+def _write_results(results: list, output_filename: str, compression: str = None):
+    # pandas and openpyxl take most of the startup time, so they are only
+    # imported once there is something to export with them.
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     df = pd.DataFrame(results)
 
-    df.drop(columns=["Fav", "Share", "Behind", ""], inplace=True, errors="ignore")
+    df.drop(columns=streaming.DROPPED_COLUMNS, inplace=True, errors="ignore")
 
     # Ensure RaceName and EventName are the first 2 columns
-    if all(col in df.columns for col in ["RaceName", "EventName"]):
+    if all(col in df.columns for col in streaming.LEADING_COLUMNS):
         df = df[
-            ["RaceName", "EventName"]
-            + [col for col in df.columns if col not in ["RaceName", "EventName"]]
+            streaming.LEADING_COLUMNS
+            + [col for col in df.columns if col not in streaming.LEADING_COLUMNS]
         ]
 
-    file_extension = output_filename.split(".")[-1].lower()
+    file_extension = streaming.get_file_extension(output_filename)
+    if streaming.get_compression(output_filename) is not None:
+        if file_extension not in streaming.TEXT_FORMATS:
+            logger.error(f"Compressed output is not supported for: {file_extension}")
+            return
+
     if file_extension == "csv":
-        df.to_csv(output_filename, index=False)
+        with streaming.open_output(output_filename) as f:
+            df.to_csv(f, index=False)
         return
 
-    numeric_columns = ["Pos", "CatPos", "GenPos", "GenPts", "Rank"]
-    datetime_columns = ["StartTime"]
-    duration_columns = ["Time", "Finish", "ResultTime", "Pace"]
+    from exporters import coercion  # pylint: disable=import-outside-toplevel
 
-    for nc in numeric_columns:
-        if nc in df.columns:
-            df[nc] = df[nc].apply(lambda x: int(x) if x.isnumeric() else x)
-
-    for dtc in datetime_columns:
-        if dtc in df.columns:
-            df[dtc] = pd.to_datetime(df[dtc], errors="coerce").fillna(df[dtc])
-
-    for dc in duration_columns:
-        if dc in df.columns:
-            df[dc] = pd.to_timedelta(df[dc], errors="coerce").fillna(df[dc])
+    # Columnar formats need a single type per column
+    df = coercion.coerce_columns(df, strict=file_extension in columnar.FORMATS)
+    duration_columns = coercion.get_columns(coercion.DURATION)
 
     if file_extension == "xlsx":
-        with pd.ExcelWriter(output_filename, engine="openpyxl") as writer:  # pylint: disable=abstract-class-instantiated
-            df.to_excel(writer, sheet_name="Results", index=False)
-
-            # Access the underlying openpyxl workbook and worksheet objects
-            wb: Workbook = writer.book
-            ws: Worksheet = wb.active
-
-            header_row = next(ws.rows)
-            for index, header_cell in enumerate(header_row):
-                if header_cell.value in duration_columns:
-                    col = ws.column_dimensions[get_column_letter(index + 1)]
-                    col.number_format = "hh:mm:ss.000"
-                    for value_cell in ws[get_column_letter(index + 1)]:
-                        value_cell.number_format = "hh:mm:ss.000"
-
-            _auto_size_columns(ws)
+        from exporters import xlsx  # pylint: disable=import-outside-toplevel
 
+        xlsx.write_xlsx(df, output_filename, duration_columns)
+    elif file_extension in columnar.FORMATS:
+        columnar.write_columnar(df, output_filename, file_extension, compression)
     elif file_extension == "json":
-        df.to_json(output_filename, orient="records")
+        with streaming.open_output(output_filename) as f:
+            df.to_json(f, orient="records")
     else:
         print(f"Unsupported file format: {file_extension}")
 
 
-def _auto_size_columns(ws: Worksheet):
-    # Iterate over all columns and adjust their widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = column[0].column_letter
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except Exception as e:
-                logger.warning(f"Could not get length of cell: {cell.coordinate} - {e}")
-
-        adjusted_width = (max_length + 2) * 1.1
-        ws.column_dimensions[column_letter].width = adjusted_width
-
-
 if __name__ == "__main__":
     try:
         main()
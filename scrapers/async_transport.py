@@ -0,0 +1,195 @@
+import asyncio
+import threading
+from contextlib import nullcontext
+from urllib.parse import urlparse
+
+import httpx
+from loguru import logger
+
+from scrapers import cache as response_cache
+from scrapers import metrics, ratelimit
+from scrapers.transport import (
+    DEFAULT_BACKOFF_BASE,
+    DEFAULT_BACKOFF_MAX,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_TIMEOUT,
+    REPLAY_KEY_HEADER,
+    REPLAY_URL_HEADER,
+    RETRY_STATUS_CODES,
+)
+
+
+class AsyncTransport:
+    """The asyncio counterpart of Transport, built on a pooled httpx.AsyncClient.
+
+    `max_connections` bounds the connections per client and `max_keepalive`
+    the idle connections kept open for reuse. `max_in_flight` and
+    `max_per_host` are budgets of concurrent requests shared by every
+    scraper running in the event loop. Requests are spaced out by
+    `rate_limiter` and retried with backoff the same way as in Transport.
+
+    Responses are neither cached nor recorded, but `replay_url` is honoured.
+    A transport belongs to the event loop it was created in, and should be
+    closed with `close()` before that loop ends.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_POOL_MAXSIZE,
+        max_keepalive: int = DEFAULT_POOL_MAXSIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_in_flight: int = None,
+        max_per_host: int = None,
+        rate_limiter: ratelimit.RateLimiter = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+        replay_url: str = None,
+    ):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.replay_url = replay_url
+        self.budget = (
+            asyncio.Semaphore(max_in_flight)
+            if max_in_flight is not None
+            else nullcontext()
+        )
+        self.max_per_host = max_per_host
+        self.host_budgets = {}
+        self.request_count = 0
+        self.loop = asyncio.get_running_loop()
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+            ),
+            timeout=timeout,
+            follow_redirects=True,
+        )
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self.replay_url is not None:
+            key = response_cache.request_key(
+                method, url, kwargs.get("json", kwargs.get("data"))
+            )
+            kwargs["headers"] = {
+                **kwargs.get("headers", {}),
+                REPLAY_KEY_HEADER: key,
+                REPLAY_URL_HEADER: url,
+            }
+
+        host = metrics.get_host(url)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.get_bucket(url).reserve())
+
+            self.request_count += 1
+            try:
+                # As in Transport, the host budget is taken first
+                async with self._get_host_budget(url), self.budget:
+                    with metrics.timed("fetch", host):
+                        response = await self.client.request(
+                            method, self.replay_url or url, **kwargs
+                        )
+            except httpx.TransportError as e:
+                metrics.increment("fetch_errors", host)
+                if attempt >= self.max_retries:
+                    raise
+                delay = ratelimit.backoff_delay(
+                    attempt, self.backoff_base, self.backoff_max
+                )
+                logger.warning(f"{e!r} - retrying {url} in {delay:.1f}s")
+            else:
+                metrics.increment("fetched_bytes", host, len(response.content))
+                if response.status_code >= 400:
+                    metrics.increment("fetch_errors", host)
+                if (
+                    response.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_retries
+                ):
+                    if self.rate_limiter is not None and response.status_code < 400:
+                        self.rate_limiter.succeeded(url)
+                    return response
+
+                retry_after = ratelimit.parse_retry_after(
+                    response.headers.get("Retry-After")
+                )
+                if self.rate_limiter is not None:
+                    self.rate_limiter.throttled(url, retry_after)
+                delay = ratelimit.backoff_delay(
+                    attempt, self.backoff_base, self.backoff_max, retry_after
+                )
+                logger.warning(
+                    f"Status code {response.status_code} - retrying {url} in {delay:.1f}s"
+                )
+
+            attempt += 1
+            metrics.increment("retries", host)
+            await asyncio.sleep(delay)
+
+    def _get_host_budget(self, url: str):
+        if self.max_per_host is None:
+            return nullcontext()
+
+        hostname = (urlparse(url).hostname or "").lower()
+        if hostname not in self.host_budgets:
+            self.host_budgets[hostname] = asyncio.Semaphore(self.max_per_host)
+        return self.host_budgets[hostname]
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_transport: AsyncTransport = None
+_options = {}
+
+
+def get_async_transport() -> AsyncTransport:
+    """Returns the transport of the running event loop, creating it if needed"""
+
+    global _transport
+    if _transport is not None and _transport.loop is not asyncio.get_running_loop():
+        _close_in_own_loop(_transport)
+        _transport = None
+
+    if _transport is None:
+        _transport = AsyncTransport(**_options)
+    return _transport
+
+
+def _close_in_own_loop(transport: AsyncTransport):
+    """Closes the transport of another event loop, as far as that loop allows"""
+
+    if transport.loop.is_running():
+        asyncio.run_coroutine_threadsafe(transport.close(), transport.loop)
+    elif not transport.loop.is_closed():
+        # A loop can't be run in a thread that is running another one
+        thread = threading.Thread(
+            target=transport.loop.run_until_complete, args=(transport.close(),)
+        )
+        thread.start()
+        thread.join()
+    else:
+        logger.warning(
+            "The connections of an event loop that was closed before "
+            "async_transport.close() are only closed when garbage collected"
+        )
+
+
+def configure(**kwargs):
+    """Sets the options of the transports created from now on"""
+
+    global _options, _transport
+    _options = kwargs
+    _transport = None
+
+
+async def close():
+    global _transport
+    if _transport is not None:
+        await _transport.close()
+        _transport = None
@@ -1,40 +1,55 @@
+import asyncio
 import re
 
 from bs4 import BeautifulSoup
 from loguru import logger
 
-from scrapers import scraper
+from scrapers import metrics, scraper, table
+
+PARSER = scraper.FAST_PARSER
+
+# Riders are listed as "Name (LicenseNr)"
+NAME_REGEX = re.compile(r"(.*)\s\((.*)\)")
 
 DATA_URL_TEMPLATE = "https://live.ultimate.dk/desktop/front/data.php?results_startrecord=1000000&eventid={eventid}&mode=results&distance={distance_id}&category=&language=us"
 
 
 class BouttimeScraper(scraper.Scraper):
-    url: str = None
+    def iter_results(self):
+        soup = scraper.get(self.url, PARSER, _validate_page)
 
-    def __init__(self, url):
-        self.url = url
+        if soup is None:
+            logger.error("Failed to download the URL")
+            return
 
-    def get_results(self):
-        soup = scraper.get(self.url)
+        for result in _extract_results(soup, self.url):
+            yield result
 
-        # Delete viewstate elements from soup
-        viewstate_elements = [
-            "__VIEWSTATE",
-            "__VIEWSTATEGENERATOR",
-            "__EVENTVALIDATION",
-        ]
-        for viewstate_element in viewstate_elements:
-            for viewstate in soup.find_all(id=viewstate_element):
-                if viewstate is not None:
-                    viewstate.decompose()
+    async def aiter_results(self):
+        soup = await scraper.aget(self.url, PARSER, _validate_page)
 
         if soup is None:
             logger.error("Failed to download the URL")
-            return []
+            return
+
+        results = await asyncio.to_thread(_extract_results, soup, self.url)
+        for result in results:
+            yield result
+
 
+def _extract_results(soup: BeautifulSoup, url: str) -> list:
+    host = metrics.get_host(url)
+    with metrics.timed("extract", host):
         results = list(_get_results_from_main(soup))
+    metrics.increment("rows", host, len(results))
+    return results
 
-        return results
+
+def _validate_page(soup: BeautifulSoup) -> bool:
+    return (
+        soup.find(id="ContentPlaceHolder1_lblRaceName") is not None
+        and soup.select_one("div.container table") is not None
+    )
 
 
 def _get_results_from_main(soup: BeautifulSoup) -> list:
@@ -46,33 +61,20 @@ def _get_results_from_main(soup: BeautifulSoup) -> list:
         logger.error("No results table found")
         return
 
-    rows = results_table.find_all("tr")
-    header_row = rows[0]
-    headers = dict(
-        (index, _propercase_and_remove_spaces(th.text))
-        for index, th in enumerate(header_row.find_all("th"))
-        if "d-xs-table-cell" not in th.get("class", [])
+    # There are some th cells in the table body! They copied the output format from FinishTime!
+    yield from table.extract_table(
+        results_table,
+        hidden_class=table.HIDDEN_CLASS,
+        initial={"RaceName": race_name, "EventName": distance_name},
+        split_columns={"Name": _split_name},
     )
-    for row in rows[1:]:
-        # There are some th cells in the table body! They copied the output format from FinishTime!
-        cells = [child for child in row.children if child.name in ["td", "th"]]
-        result = {"RaceName": race_name, "EventName": distance_name}
-        for index, cell in enumerate(cells):
-            if index in headers:
-                text = cell.text.strip()
-                if headers[index] == "Name" and "(" in text:
-                    match = re.match(r"(.*)\s\((.*)\)", text)
-                    name = match.group(1)
-                    license_number = match.group(2)
-                    result["Name"] = name
-                    result["LicenseNr"] = license_number
-                else:
-                    result[headers[index]] = text
-
-        yield result
-
-
-def _propercase_and_remove_spaces(input_string):
-    capitalized_string = " ".join(word.capitalize() for word in input_string.split())
-    final_string = capitalized_string.replace(" ", "")
-    return final_string
+
+
+def _split_name(text: str) -> dict:
+    """Splits "Name (LicenseNr)" into both fields"""
+
+    match = NAME_REGEX.match(text)
+    if match is None:
+        return {"Name": text}
+
+    return {"Name": match.group(1), "LicenseNr": match.group(2)}
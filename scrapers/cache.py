@@ -0,0 +1,180 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_DIRECTORY = ".cache"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 500 * 1024 * 1024
+
+# Once the cache grows beyond its maximum size, entries are evicted until it
+# is back under this fraction of it, so the next puts don't evict again.
+EVICTION_TARGET = 0.9
+
+# Headers of a 304 response replacing the ones of the revalidated entry
+REVALIDATED_HEADERS = ["ETag", "Last-Modified", "Cache-Control", "Expires", "Date"]
+
+# Live results change during a race, so they are only served from the cache
+# for a short while before being revalidated.
+HOST_TTLS = {
+    "live.mobii.com": 60,
+    "live.ultimate.dk": 5 * 60,
+}
+
+# Request body fields that differ between runs without changing the response
+IGNORED_BODY_FIELDS = ["SessionId"]
+
+
+class ResponseCache:
+    """A size-bounded on-disk cache of successful responses.
+
+    Each entry is stored as `<key>.json` (metadata) and `<key>.body`. Entries
+    older than their host's TTL are revalidated with ETag/Last-Modified when
+    the server sent either, and the least recently used entries are evicted
+    once the cache grows beyond `max_size` bytes, down to `EVICTION_TARGET`
+    of it.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIRECTORY,
+        ttl: float = DEFAULT_TTL,
+        host_ttls: dict = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.host_ttls = HOST_TTLS if host_ttls is None else host_ttls
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(f.stat().st_size for f in self.directory.iterdir())
+
+    def get(self, key: str) -> dict:
+        metadata_path = self.directory / f"{key}.json"
+        try:
+            entry = json.loads(metadata_path.read_text(encoding="utf-8"))
+            entry["content"] = (self.directory / f"{key}.body").read_bytes()
+            # The modification time of the metadata file is the last access
+            # time used for LRU eviction. Another thread may have evicted the
+            # entry since it was read.
+            os.utime(metadata_path)
+        except (OSError, ValueError):
+            return None
+
+        return entry
+
+    def put(self, key: str, response: requests.Response):
+        entry = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "encoding": response.encoding,
+            "stored_at": time.time(),
+        }
+        metadata = json.dumps(entry).encode("utf-8")
+        with self._lock:
+            self._size -= self._entry_size(key)
+            (self.directory / f"{key}.body").write_bytes(response.content)
+            (self.directory / f"{key}.json").write_bytes(metadata)
+            self._size += len(response.content) + len(metadata)
+            self._evict()
+
+    def increment(self, counter: str):
+        """Counts a hit, revalidation or miss"""
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def touch(self, key: str, entry: dict, response: requests.Response) -> dict:
+        """Marks an entry revalidated by a 304 response as fresh again, and
+        returns it with the validators sent by that response"""
+
+        headers = CaseInsensitiveDict(entry["headers"])
+        for header in REVALIDATED_HEADERS:
+            if header in response.headers:
+                headers[header] = response.headers[header]
+        entry = {**entry, "headers": dict(headers), "stored_at": time.time()}
+
+        metadata = {k: v for k, v in entry.items() if k != "content"}
+        (self.directory / f"{key}.json").write_text(
+            json.dumps(metadata), encoding="utf-8"
+        )
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        hostname = (urlparse(entry["url"]).hostname or "").lower()
+        ttl = self.host_ttls.get(hostname, self.ttl)
+        return time.time() - entry["stored_at"] < ttl
+
+    def _entry_size(self, key: str) -> int:
+        size = 0
+        for suffix in [".json", ".body"]:
+            path = self.directory / f"{key}{suffix}"
+            if path.exists():
+                size += path.stat().st_size
+        return size
+
+    def _evict(self):
+        if self._size <= self.max_size:
+            return
+
+        metadata_paths = sorted(
+            self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime
+        )
+        target_size = self.max_size * EVICTION_TARGET
+        for metadata_path in metadata_paths:
+            if self._size <= target_size:
+                break
+
+            size = self._entry_size(metadata_path.stem)
+            metadata_path.unlink(missing_ok=True)
+            metadata_path.with_suffix(".body").unlink(missing_ok=True)
+            self._size -= size
+            logger.debug(f"Evicted {metadata_path.stem} from the response cache")
+
+
+def get_fixtures(directory: str) -> ResponseCache:
+    """Returns a cache that never expires or evicts, used to record fixtures"""
+
+    return ResponseCache(directory, ttl=math.inf, host_ttls={}, max_size=math.inf)
+
+
+def request_key(method: str, url: str, body=None) -> str:
+    if isinstance(body, dict):
+        body = {k: v for k, v in body.items() if k not in IGNORED_BODY_FIELDS}
+        body = json.dumps(body, sort_keys=True)
+
+    key = f"{method.upper()} {url}\n{body or ''}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def revalidation_headers(entry: dict) -> dict:
+    headers = CaseInsensitiveDict(entry["headers"])
+    revalidation = {}
+    if "ETag" in headers:
+        revalidation["If-None-Match"] = headers["ETag"]
+    if "Last-Modified" in headers:
+        revalidation["If-Modified-Since"] = headers["Last-Modified"]
+    return revalidation
+
+
+def to_response(entry: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry["status_code"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = entry["encoding"]
+    response.url = entry["url"]
+    response._content = entry["content"]  # pylint: disable=protected-access
+    return response
@@ -0,0 +1,72 @@
+import json
+import threading
+from pathlib import Path
+
+from loguru import logger
+
+
+class CheckpointStore:
+    """Records the parsed rows of every downloaded page of a crawl.
+
+    Pages are appended to a JSON Lines file as soon as they are parsed. When
+    `resume` is set, the pages recorded by a previous, interrupted run are
+    loaded, so they don't have to be downloaded again. Only those pages are
+    kept in memory; pages put during this run are only written to the file.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = Path(path)
+        self.pages = {}
+        self._lock = threading.Lock()
+
+        if resume and self.path.exists():
+            self._load()
+            logger.info(f"Resuming with {len(self.pages)} pages from {self.path}")
+
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def get(self, race: str, event: str, page: int) -> dict:
+        """Returns the number of pages and rows of a page recorded by the
+        previous run, if any"""
+
+        return self.pages.get((race, event, page))
+
+    def put(self, race: str, event: str, page: int, number_of_pages: int, rows: list):
+        entry = {
+            "race": race,
+            "event": event,
+            "page": page,
+            "number_of_pages": number_of_pages,
+            "rows": rows,
+        }
+        line = json.dumps(entry, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """Deletes the checkpoint once the crawl has completed"""
+
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+    def _load(self):
+        complete_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # The last line was cut off by the failure
+                    break
+                complete_size += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.pages[(entry["race"], entry["event"], entry["page"])] = entry
+
+        # Drops the cut off line, so pages put by this run start on a new line
+        with open(self.path, "r+b") as f:
+            f.truncate(complete_size)
@@ -1,49 +1,165 @@
+import asyncio
 import re
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
 from urllib.parse import parse_qs, urlencode, urljoin, urlparse
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from loguru import logger
 
-from scrapers import scraper
+from scrapers import metrics, scraper, table
+from scrapers.checkpoint import CheckpointStore
+
+PARSER = scraper.FAST_PARSER
+
+# Result pages only need the grid and the pager to be parsed
+PAGE_ELEMENTS = SoupStrainer(
+    id=[
+        "ctl00_Content_Main_divGrid",
+        "ctl00_Content_Main_lblTopPager",
+        "ctl00_Content_Main_grdTopPager",
+    ]
+)
 
 
 class FinishtimeScraper(scraper.Scraper):
-    url: str = None
+    uses_checkpoint = True
+    # Pages downloaded by the last crawl, not counting retries or other races
+    # sharing the transport
+    request_count: int = 0
 
-    def __init__(self, url):
-        self.url = url
+    def __init__(self, url, concurrency=1):
+        super().__init__(url, concurrency)
+        self._request_count_lock = threading.Lock()
 
-    def get_results(self):
+    def iter_results(self):
         url = _fix_main_page_url(self.url)
         if url is None:
             logger.error("Failed to fix the URL")
-            return []
+            return
 
-        soup = scraper.get(url)
+        self.request_count = 1
+        soup = scraper.get(
+            url, PARSER, scraper.has_elements("ctl00_lblRaceName", "aspnetForm")
+        )
         if soup is None:
             logger.error("Failed to download the URL")
-            return []
-
-        results = list(_get_results_from_main(soup, url))
+            return
+
+        result_count = 0
+        results = _get_results_from_main(
+            soup,
+            url,
+            self.concurrency,
+            self.checkpoint,
+            self.parse_pool,
+            self._count_request,
+        )
+        for result in results:
+            result_count += 1
+            yield result
 
-        return results
+        logger.info(
+            f"Downloaded {result_count} results in {self.request_count} requests"
+        )
 
+    def _count_request(self):
+        with self._request_count_lock:
+            self.request_count += 1
 
-def _get_results_from_main(soup: BeautifulSoup, base_url) -> list:
-    race_name = soup.find(id="ctl00_lblRaceName").text
-    events = list(_get_events(soup, base_url))
-    for event_name, event_url in events:
-        event_name = race_name if event_name is None else event_name
-        event_url = base_url if event_url is None else event_url
+    async def aiter_results(self):
+        url = _fix_main_page_url(self.url)
+        if url is None:
+            logger.error("Failed to fix the URL")
+            return
 
-        logger.debug(f"Event: {event_name} - {event_url}")
-        results = _get_results_from_event(event_url)
+        soup = await scraper.aget(
+            url, PARSER, scraper.has_elements("ctl00_lblRaceName", "aspnetForm")
+        )
+        if soup is None:
+            logger.error("Failed to download the URL")
+            return
+
+        race_name, events = _get_race_events(soup, url)
+
+        async def get_event_results(event):
+            event_name, event_url = event
+            logger.debug(f"Event: {event_name} - {event_url}")
+            results = _aget_results_from_event(
+                event_url, self.concurrency, self.checkpoint, url, self.parse_pool
+            )
+            return event_name, [r async for r in results]
+
+        # Like the threaded crawl, events are crawled concurrently and share
+        # the transport's request budget.
+        event_results = scraper.amap_ordered(
+            get_event_results, events, self.concurrency
+        )
+        async for event_name, results in event_results:
+            for result in results:
+                result["RaceName"] = race_name
+                result["EventName"] = event_name
+                yield result
+
+
+def _get_results_from_main(
+    soup: BeautifulSoup,
+    base_url,
+    concurrency: int = 1,
+    checkpoint: CheckpointStore = None,
+    parse_pool: Executor = None,
+    count_request=None,
+) -> list:
+    race_name, events = _get_race_events(soup, base_url)
+
+    def get_page_results(event_url: str, page: int) -> tuple:
+        """Returns the number of pages and the results of a page"""
+
+        if checkpoint is not None:
+            entry = checkpoint.get(base_url, event_url, page)
+            if entry is not None:
+                return entry["number_of_pages"], entry["rows"]
+
+        if count_request is not None:
+            count_request()
+        # Only the first page is needed to learn the number of pages
+        number_of_pages, results = _get_page_results(
+            _append_query_parameters(event_url, {"dt": 0, "PageNo": page}),
+            with_number_of_pages=page == 1,
+            parse_pool=parse_pool,
+        )
+        if checkpoint is not None:
+            checkpoint.put(base_url, event_url, page, number_of_pages, results)
+
+        return number_of_pages, results
+
+    event_urls = [event_url for _, event_url in events]
+    if concurrency <= 1:
+        pages = _iter_event_pages(event_urls, get_page_results)
+    else:
+        pages = _crawl_event_pages(event_urls, get_page_results, concurrency)
+
+    for index, results in pages:
         for result in results:
             result["RaceName"] = race_name
-            result["EventName"] = event_name
+            result["EventName"] = events[index][0]
             yield result
 
 
+def _get_race_events(soup: BeautifulSoup, base_url) -> tuple:
+    """Returns the race name and the name and URL of each event"""
+
+    race_name = soup.find(id="ctl00_lblRaceName").text
+    events = [
+        (
+            race_name if event_name is None else event_name,
+            base_url if event_url is None else event_url,
+        )
+        for event_name, event_url in _get_events(soup, base_url)
+    ]
+    return race_name, events
+
+
 def _get_events(soup: BeautifulSoup, base_url) -> list:
     try:
         event_select = soup.find(id="ctl00_Content_Main_divEvents")
@@ -77,36 +193,200 @@ def _get_events(soup: BeautifulSoup, base_url) -> list:
         logger.error(f"Failed to get events: {e}")
 
 
-def _get_results_from_event(event_url: str) -> list:
-    soup = scraper.get(event_url)
-    number_of_pages = _get_number_of_pages(soup)
+def _iter_event_pages(event_urls: list, get_page_results):
+    """Yields the index of the event and the results of each page, crawling
+    one page at a time"""
+
+    for index, event_url in enumerate(event_urls):
+        logger.debug(f"Event: {event_url}")
+        # The first page carries both the pager and the first page of rows, so
+        # it is only downloaded once.
+        number_of_pages, results = get_page_results(event_url, 1)
+        logger.debug(f"Number of pages: {number_of_pages}")
+        if number_of_pages == 0:
+            continue
+
+        yield index, results
+        for page in range(2, number_of_pages + 1):
+            yield index, get_page_results(event_url, page)[1]
+
+
+def _crawl_event_pages(event_urls: list, get_page_results, concurrency: int):
+    """Like `_iter_event_pages`, but downloads pages in `concurrency` threads.
+
+    The pages of the event being yielded come first. Pages of the next events
+    are prefetched with the threads left over, e.g. while the number of pages
+    of the current event is not known yet. At most `concurrency` pages of the
+    current event and `concurrency` pages of the next ones are downloaded or
+    waiting to be yielded at any time.
+    """
+    # Per event: the page futures not yielded yet, the next page to submit,
+    # the next page to yield and the number of pages, once known
+    futures = [{} for _ in event_urls]
+    next_submitted = [1] * len(event_urls)
+    next_yielded = [1] * len(event_urls)
+    page_counts = [None] * len(event_urls)
+    head = 0
+
+    def get_page_count(index: int) -> int:
+        first_page = futures[index].get(1)
+        if page_counts[index] is None and first_page is not None:
+            if first_page.done() and first_page.exception() is None:
+                page_counts[index] = first_page.result()[0]
+        return page_counts[index]
+
+    def submit_pages(executor: ThreadPoolExecutor):
+        prefetched = sum(len(f) for f in futures[head + 1 :])
+        for index in range(head, len(event_urls)):
+            while True:
+                pending = len(futures[head]) if index == head else prefetched
+                page = next_submitted[index]
+                if pending >= concurrency:
+                    break
+                if page > 1 and (
+                    get_page_count(index) is None or page > page_counts[index]
+                ):
+                    break
+
+                futures[index][page] = executor.submit(
+                    get_page_results, event_urls[index], page
+                )
+                next_submitted[index] += 1
+                if index != head:
+                    prefetched += 1
+
+            if prefetched >= concurrency:
+                return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            while head < len(event_urls):
+                submit_pages(executor)
+                page = next_yielded[head]
+                number_of_pages, results = futures[head].pop(page).result()
+                next_yielded[head] += 1
+                if page == 1:
+                    logger.debug(f"Number of pages: {number_of_pages}")
+                    page_counts[head] = number_of_pages
+                if number_of_pages != 0:
+                    yield head, results
+                if next_yielded[head] > (page_counts[head] or 0):
+                    head += 1
+        finally:
+            for event_futures in futures:
+                for future in event_futures.values():
+                    future.cancel()
+
+
+async def _aget_results_from_event(
+    event_url: str,
+    concurrency: int = 1,
+    checkpoint: CheckpointStore = None,
+    race_url: str = None,
+    parse_pool: Executor = None,
+):
+    async def get_page_results(page: int) -> tuple:
+        if checkpoint is not None:
+            entry = checkpoint.get(race_url, event_url, page)
+            if entry is not None:
+                return entry["number_of_pages"], entry["rows"]
+
+        number_of_pages, results = await _aget_page_results(
+            _append_query_parameters(event_url, {"dt": 0, "PageNo": page}),
+            with_number_of_pages=page == 1,
+            parse_pool=parse_pool,
+        )
+        if checkpoint is not None:
+            checkpoint.put(race_url, event_url, page, number_of_pages, results)
+
+        return number_of_pages, results
+
+    number_of_pages, results = await get_page_results(1)
     logger.debug(f"Number of pages: {number_of_pages}")
-    for page in range(1, number_of_pages + 1):
-        page_url = _append_query_parameters(event_url, {"dt": 0, "PageNo": page})
-        logger.debug(f"Page URL: {page_url}")
-        soup = scraper.get(page_url)
-        results = _get_results_from_page(soup)
+    if number_of_pages == 0:
+        return
+
+    for r in results:
+        yield r
+
+    pages = range(2, number_of_pages + 1)
+    async for _, results in scraper.amap_ordered(get_page_results, pages, concurrency):
         for r in results:
             yield r
 
 
+async def _aget_page_results(
+    page_url: str, with_number_of_pages: bool, parse_pool: Executor = None
+) -> tuple:
+    logger.debug(f"Page URL: {page_url}")
+    html = await scraper.afetch(page_url)
+    if html is None:
+        raise ValueError(f"Failed to download {page_url}")
+
+    # Parsing in the event loop would stall the other scrapers running in it,
+    # so pages are parsed in the parse pool, or in a thread without one
+    host = metrics.get_host(page_url)
+    with metrics.timed("parse", host):
+        number_of_pages, results = await asyncio.get_running_loop().run_in_executor(
+            parse_pool, _parse_page, html, with_number_of_pages
+        )
+    metrics.increment("rows", host, len(results))
+    return number_of_pages, results
+
+
+def _get_page_results(
+    page_url: str, with_number_of_pages: bool = False, parse_pool: Executor = None
+) -> tuple:
+    logger.debug(f"Page URL: {page_url}")
+    if parse_pool is not None:
+        return _get_page_results_in_pool(page_url, with_number_of_pages, parse_pool)
+
+    soup = scraper.get(page_url, PARSER, _validate_page, PAGE_ELEMENTS)
+    if soup is None:
+        raise ValueError(f"Failed to download {page_url}")
+
+    number_of_pages = _get_number_of_pages(soup) if with_number_of_pages else None
+    with metrics.timed("extract", metrics.get_host(page_url)):
+        results = list(_get_results_from_page(soup))
+    metrics.increment("rows", metrics.get_host(page_url), len(results))
+    return number_of_pages, results
+
+
+def _get_page_results_in_pool(
+    page_url: str, with_number_of_pages: bool, parse_pool: Executor
+) -> tuple:
+    html = scraper.fetch(page_url)
+    if html is None:
+        raise ValueError(f"Failed to download {page_url}")
+
+    # The downloading thread waits for its page to be parsed, so no more than
+    # `concurrency` pages are held in memory at a time.
+    host = metrics.get_host(page_url)
+    with metrics.timed("parse", host):
+        number_of_pages, results = parse_pool.submit(
+            _parse_page, html, with_number_of_pages
+        ).result()
+    metrics.increment("rows", host, len(results))
+    return number_of_pages, results
+
+
+def _parse_page(html: str, with_number_of_pages: bool) -> tuple:
+    """Parses a results page in the parse pool, returning the number of pages
+    and the rows as plain dicts"""
+
+    soup = scraper.parse(html, PARSER, _validate_page, PAGE_ELEMENTS)
+    number_of_pages = _get_number_of_pages(soup) if with_number_of_pages else None
+    return number_of_pages, list(_get_results_from_page(soup))
+
+
+_validate_page = scraper.has_elements("ctl00_Content_Main_divGrid")
+
+
 def _get_results_from_page(soup: BeautifulSoup) -> list:
-    rows = soup.find(id="ctl00_Content_Main_divGrid").find_all("tr")
-    header_row = rows[0]
-    headers = dict(
-        (index, _propercase_and_remove_spaces(th.text))
-        for index, th in enumerate(header_row.find_all("th"))
-        if "d-xs-table-cell" not in th.get("class", [])
+    # There are some th cells in the table body!
+    return table.extract_table(
+        soup.find(id="ctl00_Content_Main_divGrid"), hidden_class=table.HIDDEN_CLASS
     )
-    for row in rows[1:]:
-        # There are some th cells in the table body!
-        cells = [child for child in row.children if child.name in ["td", "th"]]
-        result = {}
-        for index, cell in enumerate(cells):
-            if index in headers:
-                result[headers[index]] = cell.text.strip()
-
-        yield result
 
 
 def _get_number_of_pages(soup: BeautifulSoup) -> int:
@@ -147,9 +427,3 @@ def _append_query_parameters(existing_url, additional_params):
     updated_url = parsed_url._replace(query=updated_query).geturl()
 
     return updated_url
-
-
-def _propercase_and_remove_spaces(input_string):
-    capitalized_string = " ".join(word.capitalize() for word in input_string.split())
-    final_string = capitalized_string.replace(" ", "")
-    return final_string
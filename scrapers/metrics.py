@@ -0,0 +1,189 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+from loguru import logger
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+STAGES = ["fetch", "parse", "extract", "export"]
+
+# Stages and counters are labelled by host, except for exports which are
+# labelled by format
+LABEL_NAMES = {"export": "format", "exported_rows": "format"}
+
+
+class Histogram:
+    """Counts of observed latencies per bucket, as in Prometheus"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the `q` quantile"""
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Latency histograms of each stage and counters, per host or format.
+
+    Stages are timed with `timed`, e.g. `with metrics.timed("parse", host):`.
+    Counters such as the number of bytes fetched are added with `increment`.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, label: str, seconds: float):
+        with self._lock:
+            if (stage, label) not in self.histograms:
+                self.histograms[stage, label] = Histogram()
+            self.histograms[stage, label].observe(seconds)
+
+    def increment(self, name: str, label: str, value: int = 1):
+        with self._lock:
+            self.counters[name, label] = self.counters.get((name, label), 0) + value
+
+    @contextmanager
+    def timed(self, stage: str, label: str = ""):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, label, time.perf_counter() - start)
+
+    def log_summary(self):
+        for (stage, label), histogram in sorted(
+            self.histograms.items(), key=lambda h: (_stage_order(h[0][0]), h[0][1])
+        ):
+            logger.info(
+                f"{stage} {label}: {histogram.count} in {histogram.sum:.2f}s "
+                f"(mean {histogram.sum / histogram.count * 1000:.1f}ms, "
+                f"p50 <= {histogram.quantile(0.5) * 1000:.0f}ms, "
+                f"p95 <= {histogram.quantile(0.95) * 1000:.0f}ms, "
+                f"max {histogram.max * 1000:.1f}ms)"
+            )
+
+        labels = sorted({label for _, label in self.counters})
+        for label in labels:
+            counters = ", ".join(
+                f"{name} {value}"
+                for (name, counter_label), value in sorted(self.counters.items())
+                if counter_label == label
+            )
+            logger.info(f"{label}: {counters}")
+
+    def to_dict(self) -> dict:
+        return {
+            "stages": [
+                {
+                    "stage": stage,
+                    LABEL_NAMES.get(stage, "host"): label,
+                    "count": histogram.count,
+                    "seconds": histogram.sum,
+                    "max_seconds": histogram.max,
+                    "p50_seconds": histogram.quantile(0.5),
+                    "p95_seconds": histogram.quantile(0.95),
+                    "buckets": dict(zip(BUCKETS + ["+Inf"], histogram.buckets)),
+                }
+                for (stage, label), histogram in self.histograms.items()
+            ],
+            "counters": [
+                {"name": name, LABEL_NAMES.get(name, "host"): label, "value": value}
+                for (name, label), value in self.counters.items()
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP scraper_stage_seconds Time spent in each stage",
+            "# TYPE scraper_stage_seconds histogram",
+        ]
+        for (stage, label), histogram in self.histograms.items():
+            labels = f'stage="{stage}",{LABEL_NAMES.get(stage, "host")}="{label}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ["+Inf"], histogram.buckets):
+                cumulative += count
+                lines.append(
+                    f'scraper_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"scraper_stage_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"scraper_stage_seconds_count{{{labels}}} {histogram.count}")
+
+        for name in sorted({name for name, _ in self.counters}):
+            label_name = LABEL_NAMES.get(name, "host")
+            lines.append(f"# TYPE scraper_{name}_total counter")
+            for (counter_name, label), value in self.counters.items():
+                if counter_name == name:
+                    lines.append(
+                        f'scraper_{name}_total{{{label_name}="{label}"}} {value}'
+                    )
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Writes the metrics as JSON, or as a Prometheus textfile unless the
+        path ends in .json"""
+
+        if Path(path).suffix.lower() == ".json":
+            content = json.dumps(self.to_dict(), indent=2)
+        else:
+            content = self.to_prometheus()
+
+        # Replaced atomically, so a collector never reads a partial file
+        temporary_path = f"{path}.tmp"
+        Path(temporary_path).write_text(content, encoding="utf-8")
+        os.replace(temporary_path, path)
+
+
+def _stage_order(stage: str) -> int:
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+def get_host(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+def reset() -> Metrics:
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def timed(stage: str, label: str = ""):
+    return _metrics.timed(stage, label)
+
+
+def increment(name: str, label: str, value: int = 1):
+    _metrics.increment(name, label, value)
@@ -1,12 +1,15 @@
+import asyncio
 import datetime
 import random
 import re
+import time
 from urllib.parse import parse_qs, urlencode, urljoin, urlparse
 
+import requests
 from bs4 import BeautifulSoup
 from loguru import logger
 
-from scrapers import scraper
+from scrapers import metrics, scraper, table
 
 guid_pattern = (
     r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
@@ -15,52 +18,169 @@ guid_regex = re.compile(f"^{guid_pattern}$")
 
 MOBIIELITE_API_BASE_URL = "https://live.mobii.com/"
 INCLUDE_ALL_FIELDS = False
+PARSER = scraper.FAST_PARSER
+RESULTS_CHUNK_SIZE = 1000
+# Fields identifying a record across polls of a live race, in order of preference
+RECORD_KEY_FIELDS = ["id", "bn"]
 
 
 class MobiiEliteScraper(scraper.Scraper):
-    url: str = None
+    supports_watch = True
     race_id: str = None
 
-    def __init__(self, url):
-        self.url = url
+    def iter_results(self):
+        soup = self._get_main_page()
+        if soup is None:
+            return
+
+        for result in _get_results_from_main(soup, self.race_id, self.concurrency):
+            yield result
+
+    async def aiter_results(self):
+        url = self._get_main_page_url()
+        if url is None:
+            return
+
+        soup = await scraper.aget(url, PARSER, scraper.has_elements("myTabContent2"))
+        if soup is None:
+            logger.error("Failed to download the URL")
+            return
+
+        race_name = soup.find("title").text
+        display_id = _get_display_id(soup)
+        columns = _get_columns(await _aget_display_configuration(display_id))
+
+        records = [
+            r
+            async for r in _aget_results_from_results_engine(
+                display_id, self.race_id, self.concurrency
+            )
+        ]
+        results = await asyncio.to_thread(
+            lambda: list(_get_sorted_results(columns, records, race_name))
+        )
+        for r in results:
+            yield r
+
+    def watch(self, interval: float, on_change):
+        """Polls for changed results every `interval` seconds, until interrupted.
+
+        `on_change` is called with the full list of results whenever anything
+        changed since the previous poll.
+        """
+        soup = self._get_main_page()
+        if soup is None:
+            return
+
+        race_name, display_id, columns = _get_race_configuration(soup)
+
+        # Only records modified since the last poll are sent by the API, so
+        # they are merged into the records seen so far.
+        records = {}
+        state = {"ModifiedTicks": 0}
+        while True:
+            # A failed poll is retried at the next interval, from the same
+            # ticks, so that no modified records are skipped
+            poll_state = dict(state)
+            try:
+                polled = list(
+                    _get_results_from_results_engine(
+                        display_id, self.race_id, self.concurrency, state=poll_state
+                    )
+                )
+            except (requests.RequestException, ValueError) as e:
+                logger.error(f"Failed to poll the results: {e}")
+                time.sleep(interval)
+                continue
+
+            state = poll_state
+            changes = 0
+            for record in polled:
+                key = _get_record_key(record)
+                if records.get(key) != record:
+                    records[key] = record
+                    changes += 1
+
+            logger.info(f"{changes} changed results, {len(records)} in total")
+            if changes > 0:
+                results = _get_sorted_results(
+                    columns, (dict(r) for r in records.values()), race_name
+                )
+                on_change(list(results))
+
+            time.sleep(interval)
+
+    def _get_main_page(self) -> BeautifulSoup:
+        url = self._get_main_page_url()
+        if url is None:
+            return None
+
+        soup = scraper.get(url, PARSER, scraper.has_elements("myTabContent2"))
+        if soup is None:
+            logger.error("Failed to download the URL")
+            return None
 
-    def get_results(self):
+        return soup
+
+    def _get_main_page_url(self) -> str:
         self.race_id = _get_race_id(self.url)
         url = _fix_main_page_url(self.url, self.race_id)
         if url is None:
             logger.error("Failed to fix the URL")
-            return []
+        return url
 
-        soup = scraper.get(url)
-        if soup is None:
-            logger.error("Failed to download the URL")
-            return []
 
-        results = list(_get_results_from_main(soup, self.race_id))
+def _get_results_from_main(
+    soup: BeautifulSoup, race_id: str, concurrency: int = 1
+) -> list:
+    race_name, display_id, columns = _get_race_configuration(soup)
 
-        return results
+    results = _get_results_from_results_engine(display_id, race_id, concurrency)
+    for r in _get_sorted_results(columns, results, race_name):
+        yield r
 
 
-def _get_results_from_main(soup: BeautifulSoup, race_id: str) -> list:
+def _get_race_configuration(soup: BeautifulSoup) -> tuple:
     race_name = soup.find("title").text
     display_id = _get_display_id(soup)
 
-    display_configuration = _get_display_configuration(display_id)[0]
+    columns = _get_columns(_get_display_configuration(display_id))
+
+    return race_name, display_id, columns
+
 
-    display_configuration["Columns"].append({"JSONField": "cn", "Name": "EventName"})
+def _get_columns(display_configurations: list) -> list:
+    columns = display_configurations[0]["Columns"]
+    columns.append({"JSONField": "cn", "Name": "EventName"})
+    return columns
 
-    results = _get_results_from_results_engine(display_id, race_id)
-    parsed = _parse_results(display_configuration["Columns"], results["Results"])
 
-    parsed = sorted(parsed, key=lambda x: (x["EventName"], x["CoursePosition"]))
+def _get_sorted_results(columns: list, results, race_name: str) -> list:
+    # Downloaded first, so that only the extraction is timed
+    results = list(results)
+
+    host = metrics.get_host(MOBIIELITE_API_BASE_URL)
+    with metrics.timed("extract", host):
+        parsed = _parse_results(columns, results)
+        parsed = sorted(parsed, key=lambda x: (x["EventName"], x["CoursePosition"]))
+    metrics.increment("rows", host, len(parsed))
 
     for r in parsed:
         r["RaceName"] = race_name
         yield r
 
 
+def _get_record_key(record: dict):
+    for field in RECORD_KEY_FIELDS:
+        if record.get(field) is not None:
+            return (field, record[field])
+
+    # Keying on the whole record would add every changed record as a new one
+    raise KeyError(f"Result record has none of the fields {RECORD_KEY_FIELDS}")
+
+
 def _parse_results(columns: list, results: list) -> list:
-    for r in [rec for rec in results if "ia" in rec and rec["ia"]]:
+    for r in (rec for rec in results if "ia" in rec and rec["ia"]):
         result = {}
 
         r["csp"] = r["cp"]
@@ -144,20 +264,107 @@ def _get_display_id_from_data_src(data_src: str) -> str:
     return match.group(1)
 
 
-def _get_results_from_results_engine(display_id: str, race_id: str) -> list:
+def _get_results_from_results_engine(
+    display_id: str,
+    race_id: str,
+    concurrency: int = 1,
+    chunk_size: int = RESULTS_CHUNK_SIZE,
+    state: dict = None,
+) -> list:
+    """Yields the raw result records of a race.
+
+    When `state` is given, only records modified after its "ModifiedTicks"
+    are requested, and it is updated with the ticks returned by the API.
+    """
     # url = f"https://live.mobii.com/Result/RenderEngine?DisplayId={display_id}&RaceId={race_id}"
 
-    url = urljoin(MOBIIELITE_API_BASE_URL, "api/Results/GetResults2")
+    url = _get_results_url()
 
     session_id = _generate_session_id()
+    modified_ticks = 0 if state is None else state["ModifiedTicks"]
+
+    def get_chunk(index: int) -> dict:
+        data = _get_results_request(
+            race_id, session_id, index, chunk_size, modified_ticks
+        )
+        response = scraper.post_json(url, data)
+        if response is None:
+            # A missing chunk would look like the last one and end the paging
+            raise ValueError(
+                f"Failed to download results {index} to {index + chunk_size}"
+            )
+        return response
+
+    # The total number of results is not known up front, so chunks are
+    # requested `concurrency` at a time until one comes back short.
+    index = 0
+    while True:
+        indexes = range(index, index + chunk_size * concurrency, chunk_size)
+        for response in scraper.map_ordered(get_chunk, indexes, concurrency):
+            if state is not None:
+                state["ModifiedTicks"] = max(
+                    state["ModifiedTicks"], response.get("ModifiedTicks") or 0
+                )
+
+            chunk = response["Results"]
+            for r in chunk:
+                yield r
+
+            if len(chunk) < chunk_size:
+                return
+
+        index += chunk_size * concurrency
+
+
+async def _aget_results_from_results_engine(
+    display_id: str,
+    race_id: str,
+    concurrency: int = 1,
+    chunk_size: int = RESULTS_CHUNK_SIZE,
+):
+    """Like `_get_results_from_results_engine`, with the chunks requested as
+    tasks in the event loop"""
+
+    url = _get_results_url()
+    session_id = _generate_session_id()
+
+    async def get_chunk(index: int) -> dict:
+        data = _get_results_request(race_id, session_id, index, chunk_size)
+        response = await scraper.apost_json(url, data)
+        if response is None:
+            raise ValueError(
+                f"Failed to download results {index} to {index + chunk_size}"
+            )
+        return response
+
+    index = 0
+    while True:
+        indexes = range(index, index + chunk_size * concurrency, chunk_size)
+        async for response in scraper.amap_ordered(get_chunk, indexes, concurrency):
+            chunk = response["Results"]
+            for r in chunk:
+                yield r
+
+            if len(chunk) < chunk_size:
+                return
+
+        index += chunk_size * concurrency
+
+
+def _get_results_url() -> str:
+    return urljoin(MOBIIELITE_API_BASE_URL, "api/Results/GetResults2")
 
-    data = {
+
+def _get_results_request(
+    race_id: str, session_id: str, index: int, count: int, modified_ticks: int = 0
+) -> dict:
+    return {
         "ResultType": 1,
         "CourseEntityType": 4,
-        "ModifiedTicks": 0,
+        "ModifiedTicks": modified_ticks,
         "RaceId": race_id,
-        "Index": 0,
-        "Count": 1000000,
+        "Index": index,
+        "Count": count,
         "GenderType": 0,
         "GroupItemId": None,
         "SessionId": session_id,
@@ -179,16 +386,20 @@ def _get_results_from_results_engine(display_id: str, race_id: str) -> list:
         ],
     }
 
-    response = scraper.post_json(url, data)
-    return response
-
 
 def _get_display_configuration(display_id: str) -> dict:
-    url = urljoin(
+    return scraper.get_json(_get_display_configuration_url(display_id))
+
+
+async def _aget_display_configuration(display_id: str) -> dict:
+    return await scraper.aget_json(_get_display_configuration_url(display_id))
+
+
+def _get_display_configuration_url(display_id: str) -> str:
+    return urljoin(
         MOBIIELITE_API_BASE_URL,
         f"api/DisplayLayouts/GetDisplayLayoutsForDisplay?displayid={display_id}",
     )
-    return scraper.get_json(url)
 
 
 def _generate_session_id():
@@ -242,22 +453,10 @@ def _get_results_from_event(event_url: str) -> list:
 
 
 def _get_results_from_page(soup: BeautifulSoup) -> list:
-    rows = soup.find(id="ctl00_Content_Main_divGrid").find_all("tr")
-    header_row = rows[0]
-    headers = dict(
-        (index, _propercase_and_remove_spaces(th.text))
-        for index, th in enumerate(header_row.find_all("th"))
-        if "d-xs-table-cell" not in th.get("class", [])
+    # There are some th cells in the table body!
+    return table.extract_table(
+        soup.find(id="ctl00_Content_Main_divGrid"), hidden_class=table.HIDDEN_CLASS
     )
-    for row in rows[1:]:
-        # There are some th cells in the table body!
-        cells = [child for child in row.children if child.name in ["td", "th"]]
-        result = {}
-        for index, cell in enumerate(cells):
-            if index in headers:
-                result[headers[index]] = cell.text.strip()
-
-        yield result
 
 
 def _get_number_of_pages(soup: BeautifulSoup) -> int:
@@ -301,9 +500,3 @@ def _append_query_parameters(existing_url, additional_params):
     updated_url = parsed_url._replace(query=updated_query).geturl()
 
     return updated_url
-
-
-def _propercase_and_remove_spaces(input_string):
-    capitalized_string = " ".join(word.capitalize() for word in input_string.split())
-    final_string = capitalized_string.replace(" ", "")
-    return final_string
@@ -0,0 +1,115 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# Never slow a throttled host down below this many requests per second
+MIN_RATE = 0.1
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds to wait before using it"""
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        """Holds back all further requests for at least `seconds`"""
+
+        with self._lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.rate / 2, MIN_RATE)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.rate * 1.05, self.max_rate)
+
+
+class RateLimiter:
+    """A token bucket per hostname.
+
+    The rate of a host is halved whenever it throttles a request and recovers
+    gradually with every successful one.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, host_rates: dict = None):
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = {} if host_rates is None else host_rates
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def get_bucket(self, url: str) -> TokenBucket:
+        hostname = (urlparse(url).hostname or "").lower()
+        with self._lock:
+            if hostname not in self.buckets:
+                rate = self.host_rates.get(hostname, self.rate)
+                self.buckets[hostname] = TokenBucket(rate, self.burst)
+            return self.buckets[hostname]
+
+    def acquire(self, url: str):
+        self.get_bucket(url).acquire()
+
+    def throttled(self, url: str, retry_after: float = None):
+        bucket = self.get_bucket(url)
+        bucket.slow_down()
+        if retry_after is not None:
+            bucket.pause(retry_after)
+
+    def succeeded(self, url: str):
+        self.get_bucket(url).speed_up()
+
+
+def backoff_delay(
+    attempt: int, base: float, maximum: float, retry_after: float = None
+) -> float:
+    """Exponential backoff with full jitter, unless the server said how long to wait"""
+
+    if retry_after is not None:
+        return min(retry_after, maximum)
+    return random.uniform(0, min(maximum, base * 2**attempt))
+
+
+def parse_retry_after(value: str) -> float:
+    """Parses a Retry-After header, given either in seconds or as an HTTP date"""
+
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
@@ -1,36 +1,195 @@
+import asyncio
+import multiprocessing
+import re
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from loguru import logger
 
+from scrapers import metrics
+from scrapers.transport import get_transport
+
+# html5lib parses every page the way a browser does, but it is by far the
+# slowest backend. Scrapers parse with FAST_PARSER and only fall back to
+# PARSER when a page fails validation.
 PARSER = "html5lib"
 
+try:
+    import lxml  # noqa: F401 pylint: disable=unused-import
+
+    FAST_PARSER = "lxml"
+except ImportError:
+    FAST_PARSER = "html.parser"
+
+# ASP.NET pages carry large hidden form state fields that no scraper needs
+VIEWSTATE_REGEX = re.compile(
+    r"<input[^>]*\b(?:id|name)=\"__(?:VIEWSTATE\w*|EVENTVALIDATION)\"[^>]*>",
+    re.IGNORECASE,
+)
+
 
 class Scraper(ABC):
+    url: str = None
+    concurrency: int = 1
+    # Multi-page scrapers set uses_checkpoint and record their progress in
+    # checkpoint, see CheckpointStore
+    uses_checkpoint: bool = False
+    checkpoint = None
+    # Scrapers of live results set this and implement
+    # watch(interval, on_change)
+    supports_watch: bool = False
+    # Processes parsing pages while threads download them, see get_parse_pool
+    parse_pool: Executor = None
+
+    def __init__(self, url, concurrency=1):
+        self.url = url
+        self.concurrency = concurrency
+
     @abstractmethod
-    def get_results(self):
-        pass
+    def iter_results(self):
+        """Yields results as they are downloaded"""
+
+    def get_results(self) -> list:
+        return list(self.iter_results())
+
+    @abstractmethod
+    async def aiter_results(self):
+        """Asynchronously yields results as they are downloaded, sharing the
+        event loop's AsyncTransport with any other scrapers running in it"""
+
+    async def aget_results(self) -> list:
+        return [result async for result in self.aiter_results()]
+
+
+def map_ordered(func, items, concurrency: int = 1):
+    """Like `map`, but runs up to `concurrency` calls at a time in threads.
+
+    Results are yielded in the order of `items`. At most `concurrency` calls
+    are in flight or waiting to be consumed at any time.
+    """
+    if concurrency <= 1:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= concurrency:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+
+        while pending:
+            yield pending.popleft().result()
+
+
+async def amap_ordered(func, items, concurrency: int = 1):
+    """Like `map_ordered`, but runs up to `concurrency` calls of the coroutine
+    function `func` at a time as tasks in the event loop"""
+
+    pending = deque()
+    try:
+        for item in items:
+            if len(pending) >= max(concurrency, 1):
+                yield await pending.popleft()
+            pending.append(asyncio.ensure_future(func(item)))
+
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
 
 
-def get(url: str) -> BeautifulSoup:
+def get_parse_pool(workers: int):
+    """Returns a process pool to parse pages in, or a null context when
+    `workers` is 0 and pages are parsed in the downloading threads.
+
+    Parsing is CPU-bound and holds the GIL, so threads only ever parse on one
+    core. Functions run in the pool have to be top-level and should return
+    plain rows rather than soup objects, which are expensive to pickle.
+
+    Starting the workers is slow, so one pool should be shared by all the
+    scrapers of a run through their `parse_pool`.
+    """
+    if workers <= 0:
+        return nullcontext()
+
+    # Forking while the download threads hold locks could deadlock the workers
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def fetch(url: str) -> str:
     logger.debug(f"Downloading {url}")
-    response = requests.get(url, timeout=30)
+    response = get_transport().request("GET", url)
 
     if response.status_code == 200:
-        soup = BeautifulSoup(response.text, PARSER)
-        return soup
+        return response.text
 
     logger.error(f"Failed to download the URL. Status code: {response.status_code}")
     return None
 
 
+def parse(
+    html: str, parser: str = None, validate=None, parse_only: SoupStrainer = None
+) -> BeautifulSoup:
+    """Parses `html` with `parser` (default: PARSER).
+
+    `parse_only` restricts the tree to the matching elements (html5lib
+    ignores it). `validate` is called with the soup and should return False
+    when an element the scraper needs is missing. The page is then parsed
+    again in full with PARSER, which copes best with broken markup.
+    """
+    parser = PARSER if parser is None else parser
+    html = VIEWSTATE_REGEX.sub("", html)
+    if parser == PARSER:
+        parse_only = None
+
+    soup = BeautifulSoup(html, parser, parse_only=parse_only)
+    if validate is None or parser == PARSER or validate(soup):
+        return soup
+
+    logger.warning(f"Page failed validation with {parser}, falling back to {PARSER}")
+    return BeautifulSoup(html, PARSER)
+
+
+def get(
+    url: str, parser: str = None, validate=None, parse_only: SoupStrainer = None
+) -> BeautifulSoup:
+    html = fetch(url)
+    if html is None:
+        return None
+
+    return _timed_parse(url, html, parser, validate, parse_only)
+
+
+def _timed_parse(
+    url: str, html: str, parser: str, validate, parse_only: SoupStrainer
+) -> BeautifulSoup:
+    with metrics.timed("parse", metrics.get_host(url)):
+        return parse(html, parser, validate, parse_only)
+
+
+def has_elements(*ids: str):
+    """Returns a `validate` function checking that all element ids are present"""
+
+    def validate(soup: BeautifulSoup) -> bool:
+        return all(soup.find(id=id) is not None for id in ids)
+
+    return validate
+
+
 def get_json(url: str):
     logger.debug(f"Downloading {url}")
-    response = requests.get(url, timeout=30)
+    response = get_transport().request("GET", url)
 
     if response.status_code == 200:
-        return response.json()
+        with metrics.timed("parse", metrics.get_host(url)):
+            return response.json()
 
     logger.error(f"Error: {response.status_code}")
     return None
@@ -38,10 +197,72 @@ def get_json(url: str):
 
 def post_json(url: str, data: dict):
     logger.debug(f"Downloading {url}")
-    response = requests.post(url, json=data, timeout=30)
+    response = get_transport().request("POST", url, json=data)
 
     if response.status_code == 200:
-        return response.json()
+        with metrics.timed("parse", metrics.get_host(url)):
+            return response.json()
 
     logger.error(f"Error: {response.status_code}")
     return None
+
+
+def _get_async_transport():
+    # httpx is only needed by the asyncio API
+    from scrapers.async_transport import (  # pylint: disable=import-outside-toplevel
+        get_async_transport,
+    )
+
+    return get_async_transport()
+
+
+async def afetch(url: str) -> str:
+    logger.debug(f"Downloading {url}")
+    response = await _get_async_transport().request("GET", url)
+
+    if response.status_code == 200:
+        return response.text
+
+    logger.error(f"Failed to download the URL. Status code: {response.status_code}")
+    return None
+
+
+async def aget(
+    url: str, parser: str = None, validate=None, parse_only: SoupStrainer = None
+) -> BeautifulSoup:
+    html = await afetch(url)
+    if html is None:
+        return None
+
+    # Parsing is CPU-bound and would stall every other scraper in the event
+    # loop, so it runs in a thread
+    return await asyncio.to_thread(
+        _timed_parse, url, html, parser, validate, parse_only
+    )
+
+
+async def aget_json(url: str):
+    logger.debug(f"Downloading {url}")
+    response = await _get_async_transport().request("GET", url)
+
+    if response.status_code == 200:
+        return await asyncio.to_thread(_timed_json, url, response)
+
+    logger.error(f"Error: {response.status_code}")
+    return None
+
+
+async def apost_json(url: str, data: dict):
+    logger.debug(f"Downloading {url}")
+    response = await _get_async_transport().request("POST", url, json=data)
+
+    if response.status_code == 200:
+        return await asyncio.to_thread(_timed_json, url, response)
+
+    logger.error(f"Error: {response.status_code}")
+    return None
+
+
+def _timed_json(url: str, response):
+    with metrics.timed("parse", metrics.get_host(url)):
+        return response.json()
@@ -1,13 +1,21 @@
+import importlib
+from typing import TYPE_CHECKING
 from urllib.parse import urlparse
 
-from scrapers.bouttime_scraper import BouttimeScraper
-from scrapers.finishtime_scraper import FinishtimeScraper
-from scrapers.mobiielite_scraper import MobiiEliteScraper
-from scrapers.scraper import Scraper
-from scrapers.ultimate_dk_scraper import UltimateDkScraper
+if TYPE_CHECKING:
+    from scrapers.scraper import Scraper
 
+# The scraper module and class for each host. Modules are only imported once
+# a URL for their host is scraped, which keeps the startup of the CLI fast.
+SCRAPERS = {
+    "results.finishtime.co.za": ("scrapers.finishtime_scraper", "FinishtimeScraper"),
+    "bouttime.co.za": ("scrapers.bouttime_scraper", "BouttimeScraper"),
+    "live.ultimate.dk": ("scrapers.ultimate_dk_scraper", "UltimateDkScraper"),
+    "mobiielite.com": ("scrapers.mobiielite_scraper", "MobiiEliteScraper"),
+}
 
-def get_scraper(url: str) -> Scraper:
+
+def get_scraper(url: str, concurrency: int = 1) -> "Scraper":
     """Returns the appropriate scraper for the given URL"""
 
     parsed = urlparse(url)
@@ -15,13 +23,9 @@ def get_scraper(url: str) -> Scraper:
     if hostname.startswith("www."):
         hostname = hostname[4:]
 
-    if hostname == "results.finishtime.co.za":
-        return FinishtimeScraper(url)
-    elif hostname == "bouttime.co.za":
-        return BouttimeScraper(url)
-    elif hostname == "live.ultimate.dk":
-        return UltimateDkScraper(url)
-    elif hostname == "mobiielite.com":
-        return MobiiEliteScraper(url)
+    if hostname not in SCRAPERS:
+        raise ValueError(f"Unknown scraper for URL: {url}")
 
-    raise ValueError(f"Unknown scraper for URL: {url}")
+    module_name, class_name = SCRAPERS[hostname]
+    scraper_class = getattr(importlib.import_module(module_name), class_name)
+    return scraper_class(url, concurrency)
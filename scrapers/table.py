@@ -0,0 +1,101 @@
+from bs4 import NavigableString, Tag
+
+# Columns with this class are only shown on small screens and duplicate others
+HIDDEN_CLASS = "d-xs-table-cell"
+
+
+def extract_table(
+    table: Tag,
+    header_cell: str = "th",
+    body_cells: tuple = ("td", "th"),
+    hidden_class: str = None,
+    recursive: bool = False,
+    initial: dict = None,
+    split_columns: dict = None,
+):
+    """Yields a dict of cell texts per body row of `table`, keyed by header.
+
+    The first row holds the headers (`header_cell` cells), which are proper
+    cased without spaces. Headers with `hidden_class` are skipped. Body cells
+    are the `body_cells` children of each row, or all such descendants when
+    `recursive` is set.
+
+    Every result starts as a copy of `initial`. `split_columns` maps a header
+    to a function returning the fields to store in place of that cell's text.
+    """
+    rows = table.find_all("tr")
+    if len(rows) == 0:
+        return
+
+    headers = get_headers(rows[0], header_cell, hidden_class)
+    yield from extract_rows(
+        rows[1:], headers, body_cells, recursive, initial, split_columns
+    )
+
+
+def get_headers(row: Tag, cell: str = "th", hidden_class: str = None) -> list:
+    """Returns the header of each cell position in `row`, or None for skipped
+    cells"""
+
+    return [
+        (
+            None
+            if hidden_class is not None and hidden_class in th.get("class", [])
+            else propercase_and_remove_spaces(th.get_text())
+        )
+        for th in row.find_all(cell)
+    ]
+
+
+def extract_rows(
+    rows,
+    headers: list,
+    cells: tuple = ("td", "th"),
+    recursive: bool = False,
+    initial: dict = None,
+    split_columns: dict = None,
+):
+    initial = {} if initial is None else initial
+    split_columns = {} if split_columns is None else split_columns
+    column_count = len(headers)
+
+    for row in rows:
+        result = initial.copy()
+        index = 0
+        for cell in row.descendants if recursive else row.children:
+            # Cells beyond the headers are ignored, all of them if there are none
+            if index == column_count:
+                break
+            if cell.name not in cells:
+                continue
+
+            header = headers[index]
+            if header is not None:
+                text = get_text(cell)
+                if header in split_columns:
+                    result.update(split_columns[header](text))
+                else:
+                    result[header] = text
+
+            index += 1
+
+        yield result
+
+
+def get_text(cell: Tag) -> str:
+    """Same as `cell.get_text().strip()`, but faster for cells holding just
+    one string"""
+
+    contents = cell.contents
+    # Comments and CDATA sections are NavigableString subclasses that
+    # get_text() leaves out, so isinstance() would return them as text
+    # pylint: disable-next=unidiomatic-typecheck
+    if len(contents) == 1 and type(contents[0]) is NavigableString:
+        return contents[0].strip()
+    return cell.get_text().strip()
+
+
+def propercase_and_remove_spaces(input_string):
+    capitalized_string = " ".join(word.capitalize() for word in input_string.split())
+    final_string = capitalized_string.replace(" ", "")
+    return final_string
@@ -0,0 +1,272 @@
+import threading
+import time
+from contextlib import nullcontext
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from scrapers import cache as response_cache
+from scrapers import metrics, ratelimit
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 60
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# Sent to the replay server, which looks up the recorded response by key
+REPLAY_KEY_HEADER = "X-Replay-Key"
+REPLAY_URL_HEADER = "X-Replay-Url"
+
+
+class Transport:
+    """A pooled, keep-alive HTTP session shared by all scrapers.
+
+    `pool_connections` is the number of hosts kept in the pool, `pool_maxsize`
+    the number of connections kept per host. With `pool_block` set, no more
+    than `pool_maxsize` connections are ever opened to a single host.
+    `max_in_flight` is a global budget of concurrent requests across all
+    hosts and threads, `max_per_host` the budget for each host.
+
+    Requests are spaced out by `rate_limiter` when one is given. Failed
+    connections and throttled or failing (429/5xx) responses are retried up
+    to `max_retries` times with jittered exponential backoff, honouring
+    Retry-After. Successful responses are stored in and served from `cache`
+    when one is given.
+
+    Every response is also stored in `recorder` when one is given, which
+    records fixtures for benchmarks/replay_server.py. With `replay_url` set,
+    all requests are sent to that replay server instead of the real hosts.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        pool_block: bool = True,
+        keep_alive: bool = True,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_in_flight: int = None,
+        max_per_host: int = None,
+        rate_limiter: ratelimit.RateLimiter = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+        cache: response_cache.ResponseCache = None,
+        recorder: response_cache.ResponseCache = None,
+        replay_url: str = None,
+    ):
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+        self.recorder = recorder
+        self.replay_url = replay_url
+        self.budget = (
+            threading.BoundedSemaphore(max_in_flight)
+            if max_in_flight is not None
+            else nullcontext()
+        )
+        self.max_per_host = max_per_host
+        self.host_budgets = {}
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        if self.cache is None and self.recorder is None and self.replay_url is None:
+            return self._send(method, url, **kwargs)
+
+        key = response_cache.request_key(
+            method, url, kwargs.get("json", kwargs.get("data"))
+        )
+        if self.replay_url is not None:
+            kwargs["headers"] = {
+                **kwargs.get("headers", {}),
+                REPLAY_KEY_HEADER: key,
+                REPLAY_URL_HEADER: url,
+            }
+
+        if self.cache is None:
+            response = self._send(method, url, **kwargs)
+        else:
+            response = self._request_cached(key, method, url, **kwargs)
+
+        if self.recorder is not None:
+            self.recorder.put(key, response)
+
+        return response
+
+    def _request_cached(
+        self, key: str, method: str, url: str, **kwargs
+    ) -> requests.Response:
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.increment("hits")
+            metrics.increment("cache_hits", metrics.get_host(url))
+            return response_cache.to_response(entry)
+
+        if entry is not None:
+            kwargs["headers"] = {
+                **kwargs.get("headers", {}),
+                **response_cache.revalidation_headers(entry),
+            }
+
+        response = self._send(method, url, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.increment("revalidations")
+            entry = self.cache.touch(key, entry, response)
+            return response_cache.to_response(entry)
+
+        self.cache.increment("misses")
+        if response.status_code == 200:
+            self.cache.put(key, response)
+
+        return response
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        host = metrics.get_host(url)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(url)
+
+            with self._lock:
+                self.request_count += 1
+
+            try:
+                # A request waiting for a busy host must not hold a global
+                # slot that requests to other hosts could use
+                with self._get_host_budget(url), self.budget:
+                    with metrics.timed("fetch", host):
+                        if self.replay_url is None:
+                            response = self.session.request(method, url, **kwargs)
+                        else:
+                            response = self.session.request(
+                                method, self.replay_url, **kwargs
+                            )
+                            response.url = url
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.increment("fetch_errors", host)
+                if attempt >= self.max_retries:
+                    raise
+                delay = ratelimit.backoff_delay(
+                    attempt, self.backoff_base, self.backoff_max
+                )
+                logger.warning(f"{e} - retrying {url} in {delay:.1f}s")
+            else:
+                metrics.increment("fetched_bytes", host, len(response.content))
+                if response.status_code >= 400:
+                    metrics.increment("fetch_errors", host)
+                if (
+                    response.status_code not in RETRY_STATUS_CODES
+                    or attempt >= self.max_retries
+                ):
+                    if self.rate_limiter is not None and response.status_code < 400:
+                        self.rate_limiter.succeeded(url)
+                    return response
+
+                retry_after = ratelimit.parse_retry_after(
+                    response.headers.get("Retry-After")
+                )
+                if self.rate_limiter is not None:
+                    self.rate_limiter.throttled(url, retry_after)
+                delay = ratelimit.backoff_delay(
+                    attempt, self.backoff_base, self.backoff_max, retry_after
+                )
+                logger.warning(
+                    f"Status code {response.status_code} - retrying {url} in {delay:.1f}s"
+                )
+
+            attempt += 1
+            metrics.increment("retries", host)
+            time.sleep(delay)
+
+    def _get_host_budget(self, url: str):
+        if self.max_per_host is None:
+            return nullcontext()
+
+        hostname = (urlparse(url).hostname or "").lower()
+        with self._lock:
+            if hostname not in self.host_budgets:
+                self.host_budgets[hostname] = threading.BoundedSemaphore(
+                    self.max_per_host
+                )
+            return self.host_budgets[hostname]
+
+    def connection_stats(self) -> dict:
+        """Returns the number of requests and new connections per host.
+
+        Every request that did not need a new connection reused a pooled one.
+        """
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                host_stats = stats.setdefault(
+                    pool.host, {"requests": 0, "connections": 0, "reused": 0}
+                )
+                host_stats["requests"] += pool.num_requests
+                host_stats["connections"] += pool.num_connections
+                host_stats["reused"] = max(
+                    host_stats["requests"] - host_stats["connections"], 0
+                )
+
+        return stats
+
+    def log_connection_stats(self):
+        if self.cache is not None:
+            logger.info(
+                f"Response cache: {self.cache.hits} hits, "
+                f"{self.cache.revalidations} revalidated, {self.cache.misses} misses"
+            )
+
+        for host, host_stats in self.connection_stats().items():
+            logger.info(
+                f"{host}: {host_stats['requests']} requests over "
+                f"{host_stats['connections']} connections "
+                f"({host_stats['reused']} reused)"
+            )
+
+    def close(self):
+        self.session.close()
+
+
+_transport: Transport = None
+
+
+def get_transport() -> Transport:
+    global _transport
+    if _transport is None:
+        _transport = Transport()
+    return _transport
+
+
+def configure(**kwargs) -> Transport:
+    """Replaces the shared transport with one built from the given options"""
+
+    global _transport
+    if _transport is not None:
+        _transport.close()
+    _transport = Transport(**kwargs)
+    return _transport
@@ -1,36 +1,79 @@
+import asyncio
 from urllib.parse import parse_qs, urljoin, urlparse
 
 from bs4 import BeautifulSoup
 from loguru import logger
 
-from scrapers import scraper
+from scrapers import metrics, scraper, table
+
+PARSER = scraper.FAST_PARSER
 
 DATA_URL_TEMPLATE = "https://live.ultimate.dk/desktop/front/data.php?results_startrecord=1000000&eventid={eventid}&mode=results&distance={distance_id}&category=&language=us"
 
 
 class UltimateDkScraper(scraper.Scraper):
-    url: str = None
+    def iter_results(self):
+        url = _fix_main_page_url(self.url)
+        if url is None:
+            logger.error("Failed to fix the URL")
+            return
 
-    def __init__(self, url):
-        self.url = url
+        soup = scraper.get(url, PARSER, scraper.has_elements("main_screen"))
+        if soup is None:
+            logger.error("Failed to download the URL")
+            return
+
+        for result in _get_results_from_main(soup, url, self.concurrency):
+            yield result
 
-    def get_results(self):
+    async def aiter_results(self):
         url = _fix_main_page_url(self.url)
         if url is None:
             logger.error("Failed to fix the URL")
-            return []
+            return
 
-        soup = scraper.get(url)
+        soup = await scraper.aget(url, PARSER, scraper.has_elements("main_screen"))
         if soup is None:
             logger.error("Failed to download the URL")
-            return []
+            return
 
-        results = list(_get_results_from_main(soup, url))
+        race_name, distances = _get_race_distances(soup, url)
 
-        return results
+        async def get_distance_results(distance):
+            distance_url, distance_name = distance
+            logger.debug(f"Distance: {distance_name}")
+            soup = await scraper.aget(distance_url, PARSER, _has_results_table)
+            results = await asyncio.to_thread(
+                _extract_distance_results, soup, distance_url
+            )
+            return _name_results(race_name, distance_name, results)
 
+        distance_results = scraper.amap_ordered(
+            get_distance_results, distances, self.concurrency
+        )
+        async for results in distance_results:
+            for result in results:
+                yield result
+
+
+def _get_results_from_main(soup: BeautifulSoup, base_url, concurrency: int = 1) -> list:
+    race_name, distances = _get_race_distances(soup, base_url)
+
+    def get_distance_results(distance):
+        distance_url, distance_name = distance
+        logger.debug(f"Distance: {distance_name}")
+        results = _get_results_from_distance(distance_url)
+        return _name_results(race_name, distance_name, results)
+
+    distance_results = scraper.map_ordered(get_distance_results, distances, concurrency)
+    for results in distance_results:
+        for result in results:
+            yield result
+
+
+def _get_race_distances(soup: BeautifulSoup, base_url) -> tuple:
+    """Returns the race name and the (data URL, name) of each distance"""
 
-def _get_results_from_main(soup: BeautifulSoup, base_url) -> list:
     race_name = (
         soup.find(id="main_screen")
         .select_one("table:nth-last-child(3) td:nth-of-type(2)")
@@ -39,21 +82,24 @@ def _get_results_from_main(soup: BeautifulSoup, base_url) -> list:
 
     event_id = parse_qs(urlparse(base_url).query)["eventid"][0]
 
-    distances = list(_get_distances(soup))
-    for distance_id, distance_name in distances:
-        distance_id = 1 if distance_id is None else distance_id
-        distance_name = race_name if distance_name is None else distance_name
-
-        logger.debug(f"Distance: {distance_name}")
-        distance_url = DATA_URL_TEMPLATE.format(
-            eventid=event_id,
-            distance_id=distance_id,
+    distances = [
+        (
+            DATA_URL_TEMPLATE.format(
+                eventid=event_id,
+                distance_id=1 if distance_id is None else distance_id,
+            ),
+            race_name if distance_name is None else distance_name,
         )
-        results = _get_results_from_distance(distance_url)
-        for result in results:
-            result["RaceName"] = race_name
-            result["EventName"] = distance_name
-            yield result
+        for distance_id, distance_name in _get_distances(soup)
+    ]
+    return race_name, distances
+
+
+def _name_results(race_name: str, distance_name: str, results: list) -> list:
+    for result in results:
+        result["RaceName"] = race_name
+        result["EventName"] = distance_name
+    return results
 
 
 def _get_distances(soup: BeautifulSoup) -> list:
@@ -79,25 +125,33 @@ def _get_distances(soup: BeautifulSoup) -> list:
 
 
 def _get_results_from_distance(distance_url: str) -> list:
-    soup = scraper.get(distance_url)
+    soup = scraper.get(distance_url, PARSER, _has_results_table)
+    return _extract_distance_results(soup, distance_url)
+
+
+def _has_results_table(soup: BeautifulSoup) -> bool:
+    return soup.select_one("table.search_result_table") is not None
+
+
+def _extract_distance_results(soup: BeautifulSoup, distance_url: str) -> list:
     if soup is None:
-        logger.error("Failed to download the URL")
-        return
-
-    rows = soup.select_one("table.search_result_table").find_all("tr")
-    header_row = rows[0]
-    headers = dict(
-        (index, _propercase_and_remove_spaces(td.text))
-        for index, td in enumerate(header_row.find_all("td"))
+        raise ValueError(f"Failed to download {distance_url}")
+
+    host = metrics.get_host(distance_url)
+    with metrics.timed("extract", host):
+        results = list(_get_results_from_table(soup))
+    metrics.increment("rows", host, len(results))
+    return results
+
+
+def _get_results_from_table(soup: BeautifulSoup) -> list:
+    # The headers are td cells too
+    return table.extract_table(
+        soup.select_one("table.search_result_table"),
+        header_cell="td",
+        body_cells=("td",),
+        recursive=True,
     )
-    for row in rows[1:]:
-        cells = row.select("td")
-        result = {}
-        for index, cell in enumerate(cells):
-            if index in headers:
-                result[headers[index]] = cell.text.strip()
-
-        yield result
 
 
 def _fix_main_page_url(url: str) -> str:
@@ -109,9 +163,3 @@ def _fix_main_page_url(url: str) -> str:
         return urljoin(base_url, f"/desktop/front/?eventid={eventid}")
 
     return None
-
-
-def _propercase_and_remove_spaces(input_string):
-    capitalized_string = " ".join(word.capitalize() for word in input_string.split())
-    final_string = capitalized_string.replace(" ", "")
-    return final_string